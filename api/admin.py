@@ -0,0 +1,84 @@
+import router
+import utils
+
+from fastapi import Request, responses
+
+from server import Hades, SETTINGS
+
+
+class Admin(router.Blueprint):
+    def __init__(self, app: Hades):
+        self.app = app
+
+    def fleet(self) -> responses.ORJSONResponse:
+        return responses.ORJSONResponse({
+            'status': 200,
+            'data': [server.as_dict() for server in self.app.live_server.servers],
+        })
+
+    @router.endpoint(
+        "/api/admin/live-servers",
+        endpoint_name="Live Servers",
+        description="Lists the live servers and their current load.",
+        methods=["GET"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def live_servers(self, request: Request):
+        return self.fleet()
+
+    @router.endpoint(
+        "/api/admin/live-servers/reload",
+        endpoint_name="Reload Live Servers",
+        description="Reloads the live server fleet from the settings file on every worker.",
+        methods=["POST"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def reload_live_servers(self, request: Request):
+        try:
+            self.app.reload_live_servers()
+        except (OSError, ValueError) as e:
+            return responses.ORJSONResponse(
+                {'status': 400, 'data': f'invalid settings file: {e}'},
+                status_code=400
+            )
+
+        await self.app.broadcast_live_servers({"action": "reload"})
+        return self.fleet()
+
+    @router.endpoint(
+        "/api/admin/live-servers/{server_id}/drain",
+        endpoint_name="Drain Live Server",
+        description="Stops new rooms going to a live server, existing rooms stay.",
+        methods=["POST"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def drain_live_server(self, request: Request, server_id: str, draining: bool = True):
+        if not self.app.live_server.drain(server_id, draining):
+            return responses.ORJSONResponse(
+                {'status': 404, 'data': 'no live server with this id'},
+                status_code=404
+            )
+
+        await self.app.broadcast_live_servers({
+            "action": "drain",
+            "id": server_id,
+            "draining": draining,
+        })
+        return self.fleet()
+
+    @router.endpoint(
+        "/metrics",
+        endpoint_name="Metrics",
+        description="Request and upstream metrics of every worker, in the prometheus text format.",
+        methods=["GET"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def metrics(self, request: Request):
+        return responses.PlainTextResponse(
+            await self.app.metrics.render(),
+            media_type="text/plain; version=0.0.4",
+        )
+
+
+def setup(app):
+    app.add_blueprint(Admin(app))
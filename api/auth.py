@@ -1,5 +1,5 @@
 import os
-import typing as t
+import asyncio
 import aiohttp
 import router
 import urllib.parse
@@ -8,6 +8,7 @@ from typing import Optional
 from fastapi import responses, Request
 from server import Hades, SETTINGS
 from utils import login_required
+from utils.discord import DiscordError
 
 CLIENT_ID = SETTINGS.client_id
 CLIENT_SECRET = SETTINGS.client_secret
@@ -15,10 +16,8 @@ CLIENT_SECRET = SETTINGS.client_secret
 ADD_SESSION = "http://spooderfy_gateway:8000/api/sessions/add"
 REDIRECT_URI = SETTINGS.redirect_uri  # ""
 
-DISCORD_BASE_URL = "https://discord.com/api"
+DISCORD_BASE_URL = SETTINGS.discord_api_url
 DISCORD_OAUTH2_AUTH = "/oauth2/authorize"
-DISCORD_OAUTH2_USER = "/users/@me"
-DISCORD_OAUTH2_TOKEN = "/oauth2/token"
 
 DISCORD_AVATAR = "https://images.discordapp.net/avatars/" \
                  "{user_id}/{avatar}.png?size=512"
@@ -39,22 +38,17 @@ def to_avatar_url(user_id: int, avatar_hash: str) -> str:
     return f"https://cdn.discordapp.com/avatars/{user_id}/{avatar_hash}.png"
 
 
+def discord_unavailable() -> responses.ORJSONResponse:
+    return responses.ORJSONResponse({
+        'status': 503,
+        'data': 'Discord is unavailable right now, try logging in again in a moment.'
+    }, status_code=503)
+
+
 class Authorization(router.Blueprint):
     def __init__(self, app: Hades):
         self.app = app
 
-        self.app.on_event("startup")(self.init_session)
-        self.app.on_event("shutdown")(self.close)
-
-        self.session: t.Optional[aiohttp.ClientSession] = None
-
-    async def init_session(self):
-        self.session = aiohttp.ClientSession()
-
-    async def close(self):
-        if self.session is not None:
-            await self.session.close()
-
     @router.endpoint(
         "/api/@me",
         endpoint_name="Discord Info",
@@ -76,8 +70,20 @@ class Authorization(router.Blueprint):
         methods=["GET"],
     )
     async def authorized(self, request: Request, code: str):
-        token = await self.get_token(code)
-        user = await self.get_user(token)
+        try:
+            token = await self.get_token(code)
+            user = await self.get_user(token) if token is not None else None
+        except DiscordError as e:
+            if e.status == 401:
+                # The token was revoked before we got to use it.
+                user = None
+            else:
+                return discord_unavailable()
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            return discord_unavailable()
+
+        if user is None:
+            return responses.RedirectResponse("/login")
 
         url = request.session.get('redirect_to')
         resp = responses.RedirectResponse(url or "/home")
@@ -113,36 +119,23 @@ class Authorization(router.Blueprint):
         return responses.RedirectResponse(make_redirect_url())
 
     async def get_token(self, code: str) -> Optional[str]:
-        data = {
-            'client_id': int(CLIENT_ID),
-            'client_secret': CLIENT_SECRET,
-            'grant_type': 'authorization_code',
-            'code': code,
-            'redirect_uri': REDIRECT_URI,
-            'scope': 'identify'
-        }
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-
-        async with self.session.post(
-            DISCORD_BASE_URL + DISCORD_OAUTH2_TOKEN,
-            data=data,
-            headers=headers,
-        ) as resp:
-            if resp.status >= 400:
-                return None
-
-            return (await resp.json())['access_token']
-
-    async def get_user(self, token: str) -> Optional[dict]:
-        async with self.session.get(
-            DISCORD_BASE_URL + DISCORD_OAUTH2_USER,
-            headers={"Authorization": f"Bearer {token}"}
-        ) as resp:
-            resp.raise_for_status()
-
-            return await resp.json()
+        """ None when discord refuses the code, it was used or made up """
+        try:
+            data = await self.app.discord.exchange_code(
+                code,
+                client_id=CLIENT_ID,
+                client_secret=CLIENT_SECRET,
+                redirect_uri=REDIRECT_URI,
+            )
+        except DiscordError as e:
+            if e.status == 429 or e.status >= 500:
+                raise
+            return None
+
+        return data['access_token']
+
+    async def get_user(self, token: str) -> dict:
+        return await self.app.discord.get_current_user(token)
 
 
 def setup(app):
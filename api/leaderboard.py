@@ -1,27 +1,120 @@
-import aiohttp
-
+import orjson
 import router
-import typing as t
+import utils
+import urllib.parse
+
+from asyncio import Future, ensure_future, shield
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
 
-from server import Hades, render_template
+from cache import TTLCache
+from leaderboard import Board, Leaderboards, Seasons, Snapshot, MEMBERS, GUILDS
+from server import Hades, mark_cacheable, render_page, render_template, SETTINGS
+from utils.pages import Page, json_response, page_response
 from fastapi import Request, responses
+from markupsafe import Markup
+from pydantic import BaseModel, validator
+
+
+class ScoreUpdate(BaseModel):
+    id: str
+    name: Optional[str] = None
+    icon: Optional[str] = None
+    invite: Optional[str] = None
+
+    # Replaces the score when given, otherwise delta is added to it
+    points: Optional[int] = None
+    delta: int = 0
+
+    @validator("icon", "invite")
+    def check_url(cls, value: Optional[str]) -> Optional[str]:
+        """ Both end up in src and href attributes, only web urls are allowed """
+        if value is None:
+            return value
+
+        url = urllib.parse.urlparse(value)
+        if url.scheme not in ("http", "https") or not url.netloc:
+            raise ValueError("must be an http(s) url")
+        return value
+
+
+class ScoreUpdates(BaseModel):
+    entries: List[ScoreUpdate]
+
+
+# The most entries one update request may change.
+MAX_UPDATES = 1000
+
+with open('./templates/404.html', encoding="utf-8") as file:
+    not_found_html = file.read()
+
+
+# The boards by the name used in urls.
+BOARD_NAMES = {
+    "members": MEMBERS,
+    "servers": GUILDS,
+    "guilds": GUILDS,
+}
+
+
+class PageCache:
+    """
+    Built pages by key, concurrent misses for one key wait on the same
+    build rather than each building the page.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_size: Optional[int] = None):
+        self._pages = TTLCache(ttl, max_size)
+        self._building: Dict[Any, Future] = {}
+
+    async def get(self, key: Any, build: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return self._pages.get(key)
+        except KeyError:
+            pass
+
+        task = self._building.get(key)
+        if task is None:
+            task = self._building[key] = ensure_future(self._build(key, build))
+            task.add_done_callback(partial(self._built, key))
+        # Shielded so a client going away doesn't cancel the build for
+        # everyone else waiting on it.
+        return await shield(task)
+
+    async def _build(self, key: Any, build: Callable[[], Awaitable[Any]]) -> Any:
+        value = await build()
+        self._pages.set(key, value)
+        return value
+
+    def _built(self, key: Any, task: Future):
+        if self._building.get(key) is task:
+            del self._building[key]
+
+        # Marks the exception as retrieved when every waiter went away.
+        if not task.cancelled():
+            task.exception()
 
 
 class Leaderboard(router.Blueprint):
     def __init__(self, app: Hades):
         self.app = app
 
-        self.app.on_event("startup")(self.init_session)
-        self.app.on_event("shutdown")(self.close)
+        mark_cacheable('development.html', 'lb_about.html', 'lb_rewards.html')
 
-        self.session: t.Optional[aiohttp.ClientSession] = None
+        self.boards = Leaderboards(sync_interval=SETTINGS.leaderboard_sync_interval)
+        self.seasons = Seasons(SETTINGS.seasons_directory)
+        self.app.on_event("startup")(self.boards.start)
+        self.app.on_event("shutdown")(self.close)
 
-    async def init_session(self):
-        self.session = aiohttp.ClientSession()
+        # Pages of the live season are built at most once every interval no
+        # matter how many people look at them, past seasons never change so
+        # their pages are kept until pushed out.
+        self.live_pages = PageCache(SETTINGS.leaderboard_render_interval, SETTINGS.rendered_cache_size)
+        self.season_pages = PageCache(max_size=SETTINGS.rendered_cache_size)
 
     async def close(self):
-        if self.session is not None:
-            await self.session.close()
+        await self.boards.close()
+        self.seasons.close()
 
     @staticmethod
     def extract_username(request: Request):
@@ -37,11 +130,13 @@ class Leaderboard(router.Blueprint):
         methods=["GET"],
     )
     async def leaderboard_general(self, request: Request):
-        template = await render_template(
-            'development.html',
-            login=self.extract_username(request)
-        )
-        return responses.HTMLResponse(content=template)
+        async def build() -> dict:
+            return {
+                'top_3_members': _top_3(self.boards.get(MEMBERS)),
+                'top_3_servers': _top_3(self.boards.get(GUILDS)),
+            }
+
+        return await self.render_cached(request, self.live_pages, ('lb_general.html',), 'lb_general.html', build)
 
     @router.endpoint(
         "/leaderboard/about",
@@ -50,11 +145,11 @@ class Leaderboard(router.Blueprint):
         methods=["GET"],
     )
     async def leaderboard_about(self, request: Request):
-        template = await render_template(
+        page = await render_page(
             'lb_about.html',
             login=self.extract_username(request)
         )
-        return responses.HTMLResponse(content=template)
+        return page_response(request, page)
 
     @router.endpoint(
         "/leaderboard/rewards",
@@ -63,11 +158,11 @@ class Leaderboard(router.Blueprint):
         methods=["GET"],
     )
     async def leaderboard_rewards(self, request: Request):
-        template = await render_template(
+        page = await render_page(
             'lb_rewards.html',
             login=self.extract_username(request)
         )
-        return responses.HTMLResponse(content=template)
+        return page_response(request, page)
 
     @router.endpoint(
         "/leaderboard/members",
@@ -75,12 +170,15 @@ class Leaderboard(router.Blueprint):
         description="Displays the global members leaderboard",
         methods=["GET"],
     )
-    async def leaderboard_member(self, request: Request):
-        template = await render_template(
-            'development.html',
-            login=self.extract_username(request)
+    async def leaderboard_member(self, request: Request, cursor: Optional[str] = None):
+        return await self.render_board(
+            request,
+            'lb_members.html',
+            self.boards.get(MEMBERS),
+            cursor,
+            "/leaderboard/members",
+            self.live_pages,
         )
-        return responses.HTMLResponse(content=template)
 
     @router.endpoint(
         "/leaderboard/servers",
@@ -88,12 +186,277 @@ class Leaderboard(router.Blueprint):
         description="Displays the global servers leaderboard",
         methods=["GET"],
     )
-    async def leaderboard_guild(self, request: Request):
-        template = await render_template(
-            'development.html',
-            login=self.extract_username(request)
+    async def leaderboard_guild(self, request: Request, cursor: Optional[str] = None):
+        return await self.render_board(
+            request,
+            'lb_guilds.html',
+            self.boards.get(GUILDS),
+            cursor,
+            "/leaderboard/servers",
+            self.live_pages,
+        )
+
+    @router.endpoint(
+        "/leaderboard/seasons/{season}/{board_name}",
+        endpoint_name="Season Leaderboard",
+        description="Displays the members or servers leaderboard of a past season",
+        methods=["GET"],
+    )
+    async def leaderboard_season(self, request: Request, season: str, board_name: str, cursor: Optional[str] = None):
+        name = BOARD_NAMES.get(board_name)
+        snapshot = self.seasons.get(season, name) if name else None
+        if snapshot is None:
+            return responses.HTMLResponse(content=not_found_html, status_code=404)
+
+        return await self.render_board(
+            request,
+            'lb_members.html' if name == MEMBERS else 'lb_guilds.html',
+            snapshot,
+            cursor,
+            f"/leaderboard/seasons/{season}/{board_name}",
+            self.season_pages,
         )
-        return responses.HTMLResponse(content=template)
+
+    async def render_board(
+        self,
+        request: Request,
+        template: str,
+        board: Union[Board, Snapshot],
+        cursor: Optional[str],
+        base_url: str,
+        pages: PageCache,
+    ):
+        async def build() -> dict:
+            try:
+                # The top 3 have their own cards, the list starts after them.
+                entries, next_cursor = board.page(cursor, SETTINGS.leaderboard_page_size, start=3)
+            except ValueError:
+                entries, next_cursor = board.page(None, SETTINGS.leaderboard_page_size, start=3)
+
+            # Rendered once here, a logged in user's page only renders
+            # the navigation around it.
+            ranking = await render_template(
+                'components/board.html',
+                guilds=template == 'lb_guilds.html',
+                top_3=_top_3(board),
+                entries=entries,
+                next_cursor=next_cursor,
+                base_url=base_url,
+            )
+            return {'ranking': Markup(ranking)}
+
+        return await self.render_cached(request, pages, (base_url, cursor), template, build)
+
+    async def render_cached(
+        self,
+        request: Request,
+        pages: PageCache,
+        key: Any,
+        template: str,
+        build: Callable[[], Awaitable[dict]],
+    ):
+        """
+        Renders `template` with the context `build` returns, both the context
+        and the page anonymous visitors see are cached under `key` so only
+        the logged in get a page of their own, rendered from the cached
+        context, and nobody's page is cached per user.
+        """
+        async def build_page():
+            context = await build()
+            return context, await render_page(template, login=None, **context)
+
+        context, page = await pages.get(key, build_page)
+
+        login = self.extract_username(request)
+        if login is not None:
+            page = await render_page(template, login=login, **context)
+        return page_response(request, page)
+
+    async def board_page(
+        self,
+        request: Request,
+        board: Union[Board, Snapshot],
+        cursor: Optional[str],
+        limit: Optional[int],
+        pages: PageCache,
+        key: Any,
+    ):
+        limit = min(max(limit or SETTINGS.leaderboard_page_size, 1), SETTINGS.leaderboard_page_size)
+
+        async def build() -> Page:
+            entries, next_cursor = board.page(cursor, limit)
+            return Page(orjson.dumps({
+                'status': 200,
+                'data': {
+                    'total': len(board),
+                    'entries': entries,
+                    'next': next_cursor,
+                }
+            }), "application/json")
+
+        try:
+            page = await pages.get((key, cursor, limit), build)
+        except ValueError:
+            return responses.ORJSONResponse(
+                {'status': 400, 'data': 'invalid cursor'},
+                status_code=400
+            )
+        return page_response(request, page)
+
+    @router.endpoint(
+        "/api/leaderboard/{board_name}",
+        endpoint_name="Leaderboard Page",
+        description="Get's a page of the members or servers leaderboard, pass the "
+                    "returned cursor to get the next page.",
+        methods=["GET"],
+    )
+    async def leaderboard_page(
+        self,
+        request: Request,
+        board_name: str,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ):
+        board = self.boards.get(BOARD_NAMES.get(board_name))
+        if board is None:
+            return _no_board()
+
+        return await self.board_page(request, board, cursor, limit, self.live_pages, board.name)
+
+    @router.endpoint(
+        "/api/leaderboard/{board_name}/{entry_id}",
+        endpoint_name="Leaderboard Entry",
+        description="Get's the rank and points of one member or server.",
+        methods=["GET"],
+    )
+    async def leaderboard_entry(self, request: Request, board_name: str, entry_id: str):
+        board = self.boards.get(BOARD_NAMES.get(board_name))
+        if board is None:
+            return _no_board()
+
+        entry = board.get(entry_id)
+        if entry is None:
+            return responses.ORJSONResponse(
+                {'status': 404, 'data': 'not on this leaderboard'},
+                status_code=404
+            )
+        return json_response(request, {'status': 200, 'data': entry})
+
+    @router.endpoint(
+        "/api/leaderboard/{board_name}/update",
+        endpoint_name="Update Leaderboard",
+        description="Adds to or sets the points of members or servers.",
+        methods=["POST"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def update_leaderboard(self, request: Request, board_name: str, updates: ScoreUpdates):
+        board = self.boards.get(BOARD_NAMES.get(board_name))
+        if board is None:
+            return _no_board()
+
+        if len(updates.entries) > MAX_UPDATES:
+            return responses.ORJSONResponse(
+                {'status': 400, 'data': f'at most {MAX_UPDATES} entries can be updated at once'},
+                status_code=400
+            )
+
+        rows = await self.boards.update(board, [
+            (entry.id, entry.name, entry.icon, entry.invite, entry.points, entry.delta)
+            for entry in updates.entries
+        ])
+        return responses.ORJSONResponse({
+            'status': 200,
+            'data': {entry_id: board.get(entry_id) for entry_id, *_ in rows},
+        })
+
+    @router.endpoint(
+        "/api/seasons",
+        endpoint_name="Seasons",
+        description="Lists the past seasons.",
+        methods=["GET"],
+    )
+    async def list_seasons(self, request: Request):
+        return json_response(request, {'status': 200, 'data': self.seasons.list()})
+
+    @router.endpoint(
+        "/api/seasons/{season}/{board_name}",
+        endpoint_name="Season Leaderboard Page",
+        description="Get's a page of the members or servers leaderboard of a past season.",
+        methods=["GET"],
+    )
+    async def season_page(
+        self,
+        request: Request,
+        season: str,
+        board_name: str,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ):
+        name = BOARD_NAMES.get(board_name)
+        snapshot = self.seasons.get(season, name) if name else None
+        if snapshot is None:
+            return _no_board()
+
+        return await self.board_page(request, snapshot, cursor, limit, self.season_pages, (season, name))
+
+    @router.endpoint(
+        "/api/seasons/{season}/{board_name}/{entry_id}",
+        endpoint_name="Season Leaderboard Entry",
+        description="Get's the rank and points of one member or server in a past season.",
+        methods=["GET"],
+    )
+    async def season_entry(self, request: Request, season: str, board_name: str, entry_id: str):
+        name = BOARD_NAMES.get(board_name)
+        snapshot = self.seasons.get(season, name) if name else None
+        if snapshot is None:
+            return _no_board()
+
+        entry = snapshot.get(entry_id)
+        if entry is None:
+            return responses.ORJSONResponse(
+                {'status': 404, 'data': 'not on this leaderboard'},
+                status_code=404
+            )
+        return json_response(request, {'status': 200, 'data': entry})
+
+    @router.endpoint(
+        "/api/seasons/{season}/end",
+        endpoint_name="End Season",
+        description="Freezes the current leaderboards as the given season.",
+        methods=["POST"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def end_season(self, request: Request, season: str):
+        try:
+            await self.seasons.freeze(season, self.boards.boards.values())
+        except ValueError:
+            return responses.ORJSONResponse(
+                {'status': 400, 'data': 'season names may only use letters, digits, - and _'},
+                status_code=400
+            )
+        except FileExistsError:
+            return responses.ORJSONResponse(
+                {'status': 409, 'data': 'this season already exists'},
+                status_code=409
+            )
+
+        return responses.ORJSONResponse({
+            'status': 200,
+            'data': {name: len(board) for name, board in self.boards.boards.items()},
+        })
+
+
+def _top_3(board: Union[Board, Snapshot]) -> List[dict]:
+    # The top 3 template always shows three cards, leave the missing blank.
+    top = board.top(3)
+    return top + [{}] * (3 - len(top))
+
+
+def _no_board() -> responses.ORJSONResponse:
+    return responses.ORJSONResponse(
+        {'status': 404, 'data': 'no leaderboard with this name'},
+        status_code=404
+    )
 
 
 def setup(app):
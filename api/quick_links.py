@@ -1,9 +1,7 @@
-import aiohttp
-
 import router
-import typing as t
 
-from server import Hades, render_template
+from server import Hades, mark_cacheable, render_page
+from utils.pages import page_response
 from fastapi import responses, Request
 
 
@@ -15,17 +13,7 @@ class QuickLinks(router.Blueprint):
     def __init__(self, app: Hades):
         self.app = app
 
-        self.app.on_event("startup")(self.init_session)
-        self.app.on_event("shutdown")(self.close)
-
-        self.session: t.Optional[aiohttp.ClientSession] = None
-
-    async def init_session(self):
-        self.session = aiohttp.ClientSession()
-
-    async def close(self):
-        if self.session is not None:
-            await self.session.close()
+        mark_cacheable('home.html')
 
     @router.endpoint(
         "/",
@@ -47,12 +35,12 @@ class QuickLinks(router.Blueprint):
         if login_info is not None:
             login_info = login_info['username']
 
-        template = await render_template(
+        page = await render_page(
             'home.html',
             render_nav=render_nav,
             login=login_info,
         )
-        return responses.HTMLResponse(content=template)
+        return page_response(request, page)
 
     @router.endpoint(
         "/invite",
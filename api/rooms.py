@@ -1,15 +1,33 @@
+import asyncio
 import aiohttp
+import rooms
 import router
-import requests
 import utils
-import typing as t
 
-from fastapi import Request, responses
+from functools import partial
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import Request, WebSocket, responses
 from pydantic import BaseModel
 
-from server import Hades, render_template, SETTINGS
-from rooms import get_room, set_room, delete_room
-from utils import login_required
+from cache import async_ttl_cache
+from distribution import LiveServer
+from server import Hades, mark_cacheable, render_page, SETTINGS
+from rooms import (
+    EmitPipeline,
+    RoomIdAllocator,
+    get_room,
+    get_rooms,
+    insert_room,
+    insert_rooms,
+    delete_room,
+    delete_rooms,
+)
+from utils import Connection, login_required
+from utils.http import GATEWAY, LIVE_SERVER, UpstreamStats
+from utils.pages import json_response, page_response
+from utils.websockets import POLICY_VIOLATION, TRY_AGAIN_LATER
 
 
 class RoomCreationInfo(BaseModel):
@@ -20,28 +38,61 @@ class RoomCreationInfo(BaseModel):
     stream_name: str
 
 
-with open('./templates/404.html', encoding="utf-8") as file:
-    not_found_html = file.read()
+class BulkRoomCreation(BaseModel):
+    rooms: List[RoomCreationInfo]
+
+
+class RoomIdList(BaseModel):
+    room_ids: List[str]
+
 
+# The most rooms a batch endpoint handles at once.
+MAX_BATCH = 100
 
-room_html = requests.get("https://spooderfy.com/static/templates/room.html").content
+ROOM_HTML_URL = "https://spooderfy.com/static/templates/room.html"
+
+
+with open('./templates/404.html', encoding="utf-8") as file:
+    not_found_html = file.read()
 
 
 class RoomEndpoints(router.Blueprint):
     def __init__(self, app: Hades):
         self.app = app
+        self.app.assets.add("room.html", ROOM_HTML_URL)
+        mark_cacheable('room.html')
+
+        self.room_ids = RoomIdAllocator(length=SETTINGS.room_id_length)
+
+        # Timings of every step of creating and deleting rooms, so a slow
+        # upstream shows up by name rather than in the endpoint's total.
+        self.step_stats: Dict[str, UpstreamStats] = {}
+        self.app.metrics.track("room_step", self.step_stats)
+
+        self.emitter = EmitPipeline(
+            self.app.http,
+            SETTINGS.gateway_emit_url,
+            max_queue=SETTINGS.emit_queue_size,
+            max_batch=SETTINGS.emit_batch_size,
+            overflow=SETTINGS.emit_overflow,
+        )
 
-        self.app.on_event("startup")(self.init_session)
+        self.app.on_event("startup")(self.init_store)
         self.app.on_event("shutdown")(self.close)
 
-        self.session: t.Optional[aiohttp.ClientSession] = None
+    async def init_store(self):
+        rooms.configure_cache(SETTINGS.room_cache_size, SETTINGS.room_cache_ttl)
+        await rooms.connect()
+        await rooms.attach_backend(self.app.cache_backend)
 
-    async def init_session(self):
-        self.session = aiohttp.ClientSession()
+        self.app.live_server.count_rooms = rooms.count_by_live_server
+        await self.app.live_server.refresh_counts()
+        await self.room_ids.refill()
 
     async def close(self):
-        if self.session is not None:
-            await self.session.close()
+        await self.emitter.close()
+        await self.room_ids.close()
+        await rooms.close()
 
     @router.endpoint(
         "/room/{room_id}",
@@ -51,13 +102,13 @@ class RoomEndpoints(router.Blueprint):
     )
     @login_required
     async def room(self, request: Request, room_id: str):
-        if get_room(room_id) is None:
+        if (await get_room(room_id)) is None:
             return responses.HTMLResponse(content=not_found_html, status_code=404)
 
-        request.session[room_id] = True
+        request.session.grant_room(room_id, SETTINGS.room_access_ttl)
 
-        html = await render_template('room.html')
-        return responses.HTMLResponse(content=html, status_code=200)
+        page = await render_page('room.html')
+        return page_response(request, page)
 
     @router.endpoint(
         "/api/room/{room_id}/webhook",
@@ -67,13 +118,13 @@ class RoomEndpoints(router.Blueprint):
     )
     @login_required
     async def get_webhook(self, request: Request, room_id: str):
-        if not request.session[room_id]:
+        if not request.session.has_room(room_id):
             return responses.ORJSONResponse({
                 "status": 403,
                 "data": "unauthorized"
             }, status_code=403)
 
-        room = get_room(room_id)
+        room = await get_room(room_id)
         if room is None:
             return responses.ORJSONResponse(
                 {
@@ -84,7 +135,7 @@ class RoomEndpoints(router.Blueprint):
             )
 
         payload = {"url": room.webhook_url}
-        return responses.ORJSONResponse(payload, status_code=200)
+        return json_response(request, payload)
 
     @router.endpoint(
         "/api/room/{room_id}/info",
@@ -94,13 +145,13 @@ class RoomEndpoints(router.Blueprint):
     )
     @login_required
     async def get_info(self, request: Request, room_id: str):
-        if not request.session[room_id]:
+        if not request.session.has_room(room_id):
             return responses.ORJSONResponse({
                 "status": 403,
                 "data": "unauthorized"
             }, status_code=403)
 
-        room = get_room(room_id)
+        room = await get_room(room_id)
         if room is None:
             return responses.ORJSONResponse(
                 {
@@ -114,7 +165,7 @@ class RoomEndpoints(router.Blueprint):
             "owner_name": room.owner_name,
             "stream_name": room.stream_name,
         }
-        return responses.ORJSONResponse(payload, status_code=200)
+        return json_response(request, payload)
 
     @router.endpoint(
         "/api/room/{room_id}/stats",
@@ -123,25 +174,189 @@ class RoomEndpoints(router.Blueprint):
         methods=["GET"],
     )
     async def get_stats(self, request: Request, room_id: str):
-        if get_room(room_id) is None:
+        stats = await self.fetch_stats(room_id)
+        if stats is None:
             return responses.ORJSONResponse(
                 {'status': 404, 'data': 'this room does not exist'},
                 status_code=404
             )
 
-        async with self.session.get(
+        return json_response(request, {'status': 200, 'data': stats})
+
+    @router.endpoint(
+        "/api/rooms/stats",
+        endpoint_name="Batch Room Stats",
+        description="Get's the stats of many rooms at once, rooms that don't exist or "
+                    "whose stats are unavailable are null.",
+        methods=["POST"],
+    )
+    async def get_many_stats(self, request: Request, query: RoomIdList):
+        room_ids = list(dict.fromkeys(query.room_ids))
+        if len(room_ids) > MAX_BATCH:
+            return _too_many_rooms()
+
+        results = await asyncio.gather(
+            *(self.fetch_stats(room_id) for room_id in room_ids),
+            return_exceptions=True,
+        )
+        data = {
+            room_id: None if isinstance(result, BaseException) else result
+            for room_id, result in zip(room_ids, results)
+        }
+        return json_response(request, {'status': 200, 'data': data})
+
+    @async_ttl_cache(
+        key_name="room_id",
+        ttl=SETTINGS.room_stats_ttl,
+        max_size=SETTINGS.room_cache_size,
+        error_ttl=SETTINGS.room_stats_error_ttl,
+    )
+    async def fetch_stats(self, room_id: str) -> Optional[dict]:
+        """
+        The room's stats from the gateway or None if there is no such room,
+        concurrent calls for one room share a single gateway request.
+        """
+        if (await get_room(room_id)) is None:
+            return None
+
+        async with self.app.http.get(
+                GATEWAY,
                 f"{self.app.gateway_url}/stats/{room_id}",
         ) as resp:
             resp.raise_for_status()
+            return {**(await resp.json())}
+
+    async def _step(self, timings: Dict[str, float], name: str, call: Awaitable):
+        stats = self.step_stats.get(name)
+        if stats is None:
+            stats = self.step_stats[name] = UpstreamStats()
+
+        start = perf_counter()
+        try:
+            return await call
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            stats.record(elapsed)
+            timings[name] = elapsed
+
+    async def _rollback(self, timings: Dict[str, float], undo: List[Tuple[str, Callable[[], Awaitable]]]):
+        """ Undoes the steps that went through, this is best effort only """
+        await asyncio.gather(
+            *(self._step(timings, name, call()) for name, call in undo),
+            return_exceptions=True,
+        )
 
-            return responses.ORJSONResponse(
-                {
-                    'status': 200,
-                    'data': {
-                        **(await resp.json())
-                    }
-                }
-            )
+    async def _live_server_call(self, server, action: str, room_id: str) -> dict:
+        url = f"{server.control}/control/{action}" \
+              f"?room={room_id}" \
+              f"&authorization={self.app.worker_token}"
+        try:
+            async with self.app.http.get(LIVE_SERVER, url, timeout=SETTINGS.room_step_timeout) as resp:
+                resp.raise_for_status()
+                if action == "get":
+                    return await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.app.live_server.report_failure(server.id)
+            raise
+
+    async def _gateway_call(self, path: str):
+        async with self.app.http.get(
+            GATEWAY,
+            f"{self.app.gateway_url}/{path}",
+            timeout=SETTINGS.room_step_timeout,
+        ) as resp:
+            resp.raise_for_status()
+
+    async def _provision(self, server: LiveServer, room_id: str, timings: Dict[str, float]) -> dict:
+        """
+        Sets a room up on its live server and the gateway returning the
+        stream info, if either fails the one that went through is undone.
+        """
+        # The live server and the gateway don't depend on each other so
+        # both are told about the room at once.
+        stream_info, added = await asyncio.gather(
+            self._step(timings, "live_server_get", self._live_server_call(server, "get", room_id)),
+            self._step(timings, "gateway_add", self._gateway_call(f"add/{room_id}?live_server={server.control}")),
+            return_exceptions=True,
+        )
+
+        error = next((r for r in (stream_info, added) if isinstance(r, BaseException)), None)
+        if error is None:
+            return stream_info
+
+        live_server_undo, gateway_undo = self._teardown_steps(server, room_id)
+        undo = []
+        if not isinstance(stream_info, BaseException):
+            undo.append(live_server_undo)
+        if not isinstance(added, BaseException):
+            undo.append(gateway_undo)
+        await self._rollback(timings, undo)
+        raise error
+
+    def _teardown_steps(self, server: LiveServer, room_id: str) -> List[Tuple[str, Callable[[], Awaitable]]]:
+        return [
+            ("live_server_delete", partial(self._live_server_call, server, "delete", room_id)),
+            ("gateway_remove", partial(self._gateway_call, f"remove/{room_id}")),
+        ]
+
+    async def _deprovision(self, server: LiveServer, room_id: str, timings: Dict[str, float]):
+        """
+        Removes a room from its live server and the gateway, both are safe
+        to repeat so a failed call is raised for the caller to retry.
+        """
+        results = await asyncio.gather(
+            *(self._step(timings, name, call()) for name, call in self._teardown_steps(server, room_id)),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _per_server(self, jobs: List[Tuple[LiveServer, Callable[[], Awaitable]]]) -> list:
+        """
+        Runs every job at once but at most `bulk_server_concurrency` of them
+        against any one live server, exceptions are returned not raised.
+        """
+        limits = {}
+
+        async def run(server: LiveServer, job: Callable[[], Awaitable]):
+            limit = limits.get(server.id)
+            if limit is None:
+                limit = limits[server.id] = asyncio.Semaphore(SETTINGS.bulk_server_concurrency)
+            async with limit:
+                return await job()
+
+        return await asyncio.gather(
+            *(run(server, job) for server, job in jobs),
+            return_exceptions=True,
+        )
+
+    def _room_data(self, server: LiveServer, room_id: str, stream_info: dict) -> dict:
+        return {
+            'url': f"https://{self.app.spooderfy_domain}/room/{room_id}",
+            'rtmp': server.rtmp,
+            'region': server.id,
+            'stream_key': stream_info['data'],
+        }
+
+    @router.endpoint(
+        "/api/rooms/timings",
+        endpoint_name="Room Step Timings",
+        description="Timings of each upstream step of creating and deleting rooms.",
+        methods=["GET"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def step_timings(self, request: Request):
+        return responses.ORJSONResponse({
+            'status': 200,
+            'data': {name: stats.as_dict() for name, stats in self.step_stats.items()},
+        })
 
     @router.endpoint(
         "/api/create/room",
@@ -151,38 +366,34 @@ class RoomEndpoints(router.Blueprint):
     )
     @utils.enforce_authorization(SETTINGS.bot_auth)
     async def create_room(self, request: Request, info: RoomCreationInfo):
-        room_id = utils.create_room_id()
-        server = self.app.live_server.get(sub_domain=info.preferred_stream_id)
-        url = f"{server.control}/control/get" \
-              f"?room={room_id}" \
-              f"&authorization={self.app.worker_token}"
-        async with self.session.get(url) as resp:
-            resp.raise_for_status()
-            stream_info = await resp.json()
+        room_id = await self.room_ids.allocate()
+        server = self.app.live_server.place(info.preferred_stream_id)
+        timings = {}
+
+        try:
+            stream_info = await self._provision(server, room_id, timings)
+            try:
+                await self._step(timings, "store", insert_room(
+                    room_id,
+                    server.id,
+                    info.webhook_url,
+                    info.owner_id,
+                    info.owner_name,
+                    info.stream_name,
+                ))
+            except Exception:
+                await self._rollback(timings, self._teardown_steps(server, room_id))
+                raise
+        except BaseException:
+            self.app.live_server.release(server.id)
+            raise
 
-        url = f"{self.app.gateway_url}/add/{room_id}" \
-              f"?live_server={server.control}"
-        async with self.session.get(url) as resp:
-            resp.raise_for_status()
-
-        set_room(
-            room_id,
-            server.id,
-            info.webhook_url,
-            info.owner_id,
-            info.owner_name,
-            info.stream_name,
-        )
         return responses.ORJSONResponse(
             {
                 'status': 200,
-                'data': {
-                    'url': f"https://{self.app.spooderfy_domain}/room/{room_id}",
-                    'rtmp': server.rtmp,
-                    'region': server.id,
-                    'stream_key': stream_info['data'],
-                }
-            }
+                'data': self._room_data(server, room_id, stream_info),
+            },
+            headers={"Server-Timing": _server_timing(timings)},
         )
 
     @router.endpoint(
@@ -193,29 +404,153 @@ class RoomEndpoints(router.Blueprint):
     )
     @utils.enforce_authorization(SETTINGS.bot_auth)
     async def delete_room(self, request: Request, room_id: str):
-        room = get_room(room_id)
+        room = await get_room(room_id)
         if room is None:
             return responses.ORJSONResponse(
                 {'status': 404, 'data': 'this room does not exist'},
                 status_code=404
             )
         live_server = self.app.live_server.get(room.live_server_id)
-        url = f"{live_server.control}/control/delete" \
-              f"?room={room.room_id}" \
-              f"&authorization={self.app.worker_token}"
-        async with self.session.get(url) as resp:
-            resp.raise_for_status()
-
-        async with self.session.get(
-            f"{self.app.gateway_url}/remove/{room_id}",
-        ) as resp:
-            resp.raise_for_status()
+        timings = {}
 
-        delete_room(room_id)
+        # The room is only forgotten once it is gone upstream so a failed
+        # delete can simply be retried.
+        await self._deprovision(live_server, room_id, timings)
+        await self._step(timings, "store", delete_room(room_id))
+        self.app.live_server.release(room.live_server_id)
 
         return responses.ORJSONResponse(
             {'status': 200, 'data': 'room deleted'},
-            status_code=200
+            status_code=200,
+            headers={"Server-Timing": _server_timing(timings)},
+        )
+
+    @router.endpoint(
+        "/api/rooms/create",
+        endpoint_name="Create Rooms",
+        description="Creates many movie rooms at once, each room gets its own "
+                    "status in the order they were given.",
+        methods=["POST"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def create_rooms(self, request: Request, bulk: BulkRoomCreation):
+        if len(bulk.rooms) > MAX_BATCH:
+            return _too_many_rooms()
+
+        placed = []
+        try:
+            # Inside the try so the servers picked for the rooms before an
+            # allocation or placement failed are given back too.
+            for info in bulk.rooms:
+                room_id = await self.room_ids.allocate()
+                placed.append((room_id, self.app.live_server.place(info.preferred_stream_id), info))
+
+            results = await self._per_server([
+                (server, partial(self._provision, server, room_id, {}))
+                for room_id, server, _ in placed
+            ])
+            created = [
+                (room_id, server, info)
+                for (room_id, server, info), result in zip(placed, results)
+                if not isinstance(result, BaseException)
+            ]
+
+            try:
+                await insert_rooms([
+                    (room_id, server.id, info.webhook_url, info.owner_id, info.owner_name, info.stream_name)
+                    for room_id, server, info in created
+                ])
+            except Exception:
+                await self._per_server([
+                    (server, partial(self._rollback, {}, self._teardown_steps(server, room_id)))
+                    for room_id, server, _ in created
+                ])
+                raise
+        except BaseException:
+            for _, server, _ in placed:
+                self.app.live_server.release(server.id)
+            raise
+
+        data = []
+        for (room_id, server, _), result in zip(placed, results):
+            if isinstance(result, BaseException):
+                self.app.live_server.release(server.id)
+                data.append({'status': 502, 'data': 'could not create the room'})
+            else:
+                data.append({'status': 200, 'data': self._room_data(server, room_id, result)})
+
+        return responses.ORJSONResponse({'status': 200, 'data': data})
+
+    @router.endpoint(
+        "/api/rooms/delete",
+        endpoint_name="Delete Rooms",
+        description="Deletes many rooms at once, each room id gets its own status.",
+        methods=["POST"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def delete_rooms(self, request: Request, query: RoomIdList):
+        room_ids = list(dict.fromkeys(query.room_ids))
+        if len(room_ids) > MAX_BATCH:
+            return _too_many_rooms()
+
+        found = await get_rooms(room_ids)
+        existing = [found[room_id] for room_id in room_ids if found[room_id] is not None]
+        servers = [self.app.live_server.get(room.live_server_id) for room in existing]
+
+        results = await self._per_server([
+            (server, partial(self._deprovision, server, room.room_id, {}))
+            for room, server in zip(existing, servers)
+        ])
+        failed = {
+            room.room_id
+            for room, result in zip(existing, results)
+            if isinstance(result, BaseException)
+        }
+
+        gone = [room for room in existing if room.room_id not in failed]
+        await delete_rooms([room.room_id for room in gone])
+        for room in gone:
+            self.app.live_server.release(room.live_server_id)
+
+        data = {}
+        for room_id in room_ids:
+            if found[room_id] is None:
+                data[room_id] = {'status': 404, 'data': 'this room does not exist'}
+            elif room_id in failed:
+                data[room_id] = {'status': 502, 'data': 'could not delete the room, try again'}
+            else:
+                data[room_id] = {'status': 200, 'data': 'room deleted'}
+
+        return responses.ORJSONResponse({'status': 200, 'data': data})
+
+    @router.endpoint(
+        "/api/rooms/lookup",
+        endpoint_name="Lookup Rooms",
+        description="Get's many rooms at once, rooms that don't exist are null.",
+        methods=["POST"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def lookup_rooms(self, request: Request, query: RoomIdList):
+        if len(query.room_ids) > MAX_BATCH:
+            return _too_many_rooms()
+
+        found = await get_rooms(query.room_ids)
+        data = {
+            room_id: None if room is None else room.as_dict()
+            for room_id, room in found.items()
+        }
+        return responses.ORJSONResponse({'status': 200, 'data': data})
+
+    def emit(self, room_id: str, event) -> responses.ORJSONResponse:
+        if not self.emitter.submit(room_id, event):
+            return responses.ORJSONResponse(
+                {'status': 429, 'data': 'too many events waiting for this room'},
+                status_code=429
+            )
+
+        return responses.ORJSONResponse(
+            {'status': 202, 'data': 'event queued'},
+            status_code=202
         )
 
     @router.endpoint(
@@ -225,11 +560,8 @@ class RoomEndpoints(router.Blueprint):
         methods=["POST"],
     )
     @utils.enforce_authorization(SETTINGS.bot_auth)
-    async def delete_room(self, request: Request, room_id: str):
-        await self.session.post(
-            f"http://spooderfy_gateway:3030/emit/{room_id}",
-            json=(await request.json())
-        )
+    async def emit_bot(self, request: Request, room_id: str):
+        return self.emit(room_id, await request.json())
 
     @router.endpoint(
         "/api/room/{room_id}/emit",
@@ -238,11 +570,51 @@ class RoomEndpoints(router.Blueprint):
         methods=["POST"],
     )
     @login_required
-    async def delete_room(self, request: Request, room_id: str):
-        await self.session.post(
-            f"http://spooderfy_gateway:3030/emit/{room_id}",
-            json=(await request.json())
+    async def emit_user(self, request: Request, room_id: str):
+        return self.emit(room_id, await request.json())
+
+    @router.websocket("/api/room/{room_id}/ws")
+    async def emit_socket(self, websocket: WebSocket, room_id: str):
+        """
+        Emits every message sent by the user to the room, for clients
+        sending lots of events this saves a request per event.
+        """
+        if websocket.session.get('info') is None or not websocket.session.has_room(room_id):
+            return await websocket.close(POLICY_VIOLATION)
+
+        conn = Connection(
+            websocket,
+            max_queue=SETTINGS.websocket_queue_size,
+            ping_interval=SETTINGS.websocket_ping_interval,
+            idle_timeout=SETTINGS.websocket_idle_timeout,
         )
+        async with conn:
+            async for event in conn:
+                if not self.emitter.submit(room_id, event):
+                    if not conn.try_send({'status': 429, 'data': 'too many events waiting for this room'}):
+                        # Not even reading our replies, let it go.
+                        await conn.close(TRY_AGAIN_LATER, "too many events")
+
+    @router.endpoint(
+        "/api/rooms/emit/stats",
+        endpoint_name="Room Emit Stats",
+        description="Queue depths and flush latency of the room event pipeline.",
+        methods=["GET"],
+    )
+    @utils.enforce_authorization(SETTINGS.bot_auth)
+    async def emit_stats(self, request: Request):
+        return responses.ORJSONResponse({'status': 200, 'data': self.emitter.stats})
+
+
+def _too_many_rooms() -> responses.ORJSONResponse:
+    return responses.ORJSONResponse(
+        {'status': 400, 'data': f'at most {MAX_BATCH} rooms can be handled at once'},
+        status_code=400
+    )
+
+
+def _server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in timings.items())
 
 
 def setup(app):
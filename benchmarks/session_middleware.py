@@ -0,0 +1,95 @@
+"""
+Compares the per request overhead of the session handling mounted through
+`app.middleware("http")` (starlette's BaseHTTPMiddleware) with the plain
+ASGI SessionMiddleware, against an app without any session handling.
+
+Run from the repository root so settings.json is found:
+
+    python -m benchmarks.session_middleware [requests]
+"""
+
+import sys
+import asyncio
+
+from time import perf_counter
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+# server has to be imported before sessions, which reads its settings.
+import server  # noqa: F401
+
+from sessions import Session, SessionCollection
+from sessions.middleware import SessionMiddleware
+
+
+async def endpoint(_request):
+    return PlainTextResponse("ok")
+
+
+def make_app(mode: str, sessions: SessionCollection) -> Starlette:
+    app = Starlette(routes=[Route("/", endpoint)])
+    if mode == "base_http":
+        app.middleware("http")(sessions.as_middleware)
+    elif mode == "asgi":
+        app.add_middleware(SessionMiddleware, sessions=sessions)
+    return app
+
+
+async def bench(app: Starlette, requests: int, cookie: bytes) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost"), (b"cookie", b"session=" + cookie)],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8080),
+    }
+
+    def make_receive():
+        messages = [
+            {"type": "http.disconnect"},
+            {"type": "http.request", "body": b"", "more_body": False},
+        ]
+
+        async def receive():
+            return messages.pop() if len(messages) > 1 else messages[0]
+        return receive
+
+    async def send(_message):
+        pass
+
+    for _ in range(min(requests, 500)):
+        await app(dict(scope), make_receive(), send)
+
+    start = perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), make_receive(), send)
+    return (perf_counter() - start) / requests
+
+
+async def main(requests: int):
+    sessions = SessionCollection()
+    cookie = sessions._sign(Session(info={"username": "bench", "id": 1}))
+
+    baseline = None
+    for mode in ("none", "base_http", "asgi"):
+        per_request = await bench(make_app(mode, sessions), requests, cookie.encode())
+        if baseline is None:
+            baseline = per_request
+
+        print(
+            f"{mode:>10}: {per_request * 1e6:8.1f} us/request"
+            f"  (+{(per_request - baseline) * 1e6:.1f} us over no middleware)"
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
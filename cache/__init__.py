@@ -1 +1,2 @@
-from .ttl import ttl_cache, async_ttl_cache
+from .ttl import TTLCache, ttl_cache, async_ttl_cache, start_sweeper, stop_sweeper
+from .shared import SharedBackend, MemoryBackend, RedisBackend, TieredCache, create_backend
@@ -0,0 +1,311 @@
+import orjson
+import logging
+
+from asyncio import CancelledError, Task, get_event_loop, sleep
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from uuid import uuid4
+
+from .ttl import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedBackend:
+    """
+    The interface of a cache shared between every worker, values are always
+    bytes and `subscribe` callbacks are called with the raw message.
+    """
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        raise NotImplementedError
+
+    async def set_many(self, items: Dict[str, bytes], ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    async def delete_many(self, keys: List[str]):
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: bytes):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, callback: Callable[[bytes], Any]):
+        raise NotImplementedError
+
+
+class MemoryBackend(SharedBackend):
+    """
+    An in-process stand-in for redis, every TieredCache given the same
+    instance behaves like a separate worker talking to one shared server.
+    """
+
+    def __init__(self):
+        self._store = TTLCache()
+        self._channels: Dict[str, List[Callable[[bytes], Any]]] = {}
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        values = []
+        for key in keys:
+            try:
+                values.append(self._store.get(key))
+            except KeyError:
+                values.append(None)
+        return values
+
+    async def set_many(self, items: Dict[str, bytes], ttl: Optional[float] = None):
+        for key, value in items.items():
+            self._store.set(key, value, ttl=ttl)
+
+    async def delete_many(self, keys: List[str]):
+        for key in keys:
+            self._store.delete(key)
+
+    async def publish(self, channel: str, message: bytes):
+        # Delivered on the next loop iteration like a real subscriber would.
+        loop = get_event_loop()
+        for callback in self._channels.get(channel, []):
+            loop.call_soon(callback, message)
+
+    async def subscribe(self, channel: str, callback: Callable[[bytes], Any]):
+        self._channels.setdefault(channel, []).append(callback)
+
+
+class RedisBackend(SharedBackend):
+    """ A shared backend on top of a redis server using aioredis """
+
+    def __init__(self, url: str):
+        self._url = url
+        self._redis = None
+        self._pubsub = None
+        self._listener: Optional[Task] = None
+        self._handlers: Dict[str, List[Callable[[bytes], Any]]] = {}
+
+    async def connect(self):
+        if self._redis is not None:
+            return
+
+        try:
+            import aioredis
+        except ImportError:
+            # aioredis has since been merged into redis-py as redis.asyncio
+            from redis import asyncio as aioredis
+
+        self._redis = aioredis.from_url(self._url)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except CancelledError:
+                pass
+            self._listener = None
+
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        return await self._redis.mget(keys)
+
+    async def set_many(self, items: Dict[str, bytes], ttl: Optional[float] = None):
+        if not items:
+            return
+
+        px = None if ttl is None else max(1, int(ttl * 1000))
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, px=px)
+            await pipe.execute()
+
+    async def delete_many(self, keys: List[str]):
+        if keys:
+            await self._redis.delete(*keys)
+
+    async def publish(self, channel: str, message: bytes):
+        await self._redis.publish(channel, message)
+
+    async def subscribe(self, channel: str, callback: Callable[[bytes], Any]):
+        if self._pubsub is None:
+            self._pubsub = self._redis.pubsub()
+
+        if channel not in self._handlers:
+            self._handlers[channel] = []
+            await self._pubsub.subscribe(channel)
+        self._handlers[channel].append(callback)
+
+        if self._listener is None:
+            self._listener = get_event_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=1.0,
+                )
+            except (ConnectionError, OSError):
+                await sleep(1)
+                continue
+
+            if message is None or message["type"] != "message":
+                continue
+
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+
+            for callback in self._handlers.get(channel, []):
+                try:
+                    callback(message["data"])
+                except Exception:
+                    # One broken subscriber mustn't stop the others hearing
+                    # about invalidations.
+                    logger.exception("subscriber of %s failed to handle a message", channel)
+
+
+def create_backend(redis_url: Optional[str] = None) -> SharedBackend:
+    """ A redis backend if a url is given otherwise a process local one """
+    if redis_url:
+        return RedisBackend(redis_url)
+    return MemoryBackend()
+
+
+class TieredCache:
+    """
+    A two tier cache, a small in-process TTLCache (the near cache) in front
+    of a backend shared by every worker.
+
+    Writes and deletes go to both tiers and then publish the changed keys on
+    `<namespace>:invalidate`, every other worker drops those keys from its
+    own near cache so the next read goes back to the shared tier.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        backend: SharedBackend,
+        ttl: Optional[float] = None,
+        near_ttl: Optional[float] = None,
+        max_size: Optional[int] = None,
+        dumps: Callable[[Any], bytes] = orjson.dumps,
+        loads: Callable[[bytes], Any] = orjson.loads,
+    ):
+        self.namespace = namespace
+        self.backend = backend
+
+        self._ttl = ttl
+        self._near = TTLCache(near_ttl if near_ttl is not None else ttl, max_size)
+        self._dumps = dumps
+        self._loads = loads
+
+        self._origin = uuid4().hex
+        self._channel = f"{namespace}:invalidate"
+        self._started = False
+
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            **self._near.stats,
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+        }
+
+    async def start(self):
+        """ Subscribes to invalidations from the other workers """
+        if not self._started:
+            self._started = True
+            await self.backend.subscribe(self._channel, self._on_invalidate)
+
+    def _on_invalidate(self, message: bytes):
+        payload = orjson.loads(message)
+        if payload["origin"] == self._origin:
+            return
+
+        for key in payload["keys"]:
+            self._near.delete(key)
+
+    def _shared_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def _invalidate_others(self, keys: List[str]):
+        await self.backend.publish(
+            self._channel,
+            orjson.dumps({"origin": self._origin, "keys": keys}),
+        )
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        return (await self.get_many([key])).get(key, default)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Returns the found keys, anything not in the near cache is fetched
+        from the shared tier in one round trip.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            try:
+                found[key] = self._near.get(key)
+            except KeyError:
+                missing.append(key)
+
+        if not missing:
+            return found
+
+        raw = await self.backend.get_many([self._shared_key(key) for key in missing])
+        for key, value in zip(missing, raw):
+            if value is None:
+                self.shared_misses += 1
+                continue
+
+            self.shared_hits += 1
+            value = self._loads(value)
+            self._near.set(key, value)
+            found[key] = value
+        return found
+
+    async def set(self, key: str, value: Any):
+        await self.set_many({key: value})
+
+    async def set_many(self, items: Dict[str, Any]):
+        if not items:
+            return
+
+        for key, value in items.items():
+            self._near.set(key, value)
+
+        await self.backend.set_many(
+            {self._shared_key(key): self._dumps(value) for key, value in items.items()},
+            ttl=self._ttl,
+        )
+        await self._invalidate_others(list(items))
+
+    async def delete(self, key: str):
+        await self.delete_many([key])
+
+    async def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        if not keys:
+            return
+
+        for key in keys:
+            self._near.delete(key)
+
+        await self.backend.delete_many([self._shared_key(key) for key in keys])
+        await self._invalidate_others(keys)
@@ -1,55 +1,242 @@
-from typing import Dict, Any, Optional, Tuple
-from asyncio import Future, get_event_loop, TimerHandle
+import heapq
+import inspect
+import weakref
 
+from asyncio import CancelledError, Future, Task, ensure_future, get_event_loop, shield, sleep
+from collections import OrderedDict
+from functools import partial, wraps
+from itertools import count
+from time import monotonic
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
-class CacheObject:
-    def __init__(self, internal: Any, ttl: Optional[float]):
-        self._value = internal
-        self._handle: Optional[TimerHandle] = None
-        self._fut: Optional[Future] = None
 
-        if ttl is not None:
-            loop = get_event_loop()
-            self._fut = loop.create_future()
-            self._handle = loop.call_later(ttl, self._fut.set_result, None)
+_DEFAULT = object()
 
-    def get_value(self) -> Tuple[bool, Any]:
-        return self._fut.done(), self._value
+# Every TTLCache registers itself here so a single sweeper task can expire
+# the keys of all of them instead of each entry owning a loop timer.
+_caches: "weakref.WeakSet[TTLCache]" = weakref.WeakSet()
+_sweeper: Optional[Task] = None
 
-    def clear(self):
-        try:
-            self._handle.cancel()
-            self._fut.cancel()
-        except:
-            pass
 
-    def __del__(self):
-        self.clear()
+class CacheEntry:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value: Any, expires_at: Optional[float]):
+        self.value = value
+        self.expires_at = expires_at
 
 
 class TTLCache:
-    def __init__(self, ttl: Optional[float]):
-        self._cache: Dict[Any, CacheObject] = {}
+    """
+    A key value store where entries expire `ttl` seconds after being set and
+    the least recently used entries are evicted once `max_size` is reached.
+
+    Expiry times are kept in a single heap ordered by the monotonic clock,
+    expired keys are removed by `sweep()` which runs a little on every `set`
+    and in full from the periodic sweeper started by `start_sweeper`, so keys
+    that are never read again still get removed.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_size: Optional[int] = None):
+        self._cache: "OrderedDict[Any, CacheEntry]" = OrderedDict()
+        self._expiry: List[Tuple[float, int, Any]] = []
+        self._counter = count()
         self._ttl = ttl
+        self._max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key: Any) -> bool:
+        entry = self._cache.get(key)
+        return entry is not None and not _is_expired(entry, monotonic())
+
+    @property
+    def ttl(self) -> Optional[float]:
+        return self._ttl
+
+    @property
+    def max_size(self) -> Optional[int]:
+        return self._max_size
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": len(self._cache),
+        }
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = _DEFAULT):
+        """
+        Sets `key` to `value`, `ttl` overrides the cache wide ttl for this
+        entry only and None makes it never expire.
+        """
+        if ttl is _DEFAULT:
+            ttl = self._ttl
+
+        now = monotonic()
+        expires_at = None if ttl is None else now + ttl
+
+        entry = self._cache.get(key)
+        if entry is None:
+            self._cache[key] = CacheEntry(value, expires_at)
+        else:
+            entry.value = value
+            entry.expires_at = expires_at
+            self._cache.move_to_end(key)
+
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, next(self._counter), key))
 
-    def set(self, key: Any, args: Any):
-        self._cache[key] = CacheObject(args, ttl=self._ttl)
+        if self._max_size is not None:
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+        self.sweep(now, limit=2)
+
+        # Overwritten and evicted keys leave their old expiry behind, rebuild
+        # the heap once those outnumber the live entries.
+        if len(self._expiry) > 2 * len(self._cache) + 64:
+            self._compact()
 
     def get(self, key: Any) -> Any:
-        should_remove, value = self._cache[key].get_value()
-        if should_remove:
-            self._cache[key].clear()
+        entry = self._cache.get(key)
+        if entry is None:
+            self.misses += 1
+            raise KeyError(f"Key {key!r} not in cache")
+
+        if _is_expired(entry, monotonic()):
             del self._cache[key]
+            self.expirations += 1
+            self.misses += 1
             raise KeyError(f"Key {key!r} not in cache")
-        return value
 
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def delete(self, key: Any) -> bool:
+        return self._cache.pop(key, None) is not None
+
+    def clear(self):
+        self._cache.clear()
+        self._expiry.clear()
+
+    def sweep(self, now: Optional[float] = None, limit: Optional[int] = None) -> int:
+        """
+        Removes expired entries from the cache, at most `limit` heap items
+        are looked at when given, returning the amount of keys removed.
+        """
+        if now is None:
+            now = monotonic()
+
+        removed = 0
+        checked = 0
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            if limit is not None and checked >= limit:
+                break
+            checked += 1
+
+            expires_at, _, key = heapq.heappop(expiry)
+            entry = self._cache.get(key)
+            if entry is not None and entry.expires_at == expires_at:
+                del self._cache[key]
+                self.expirations += 1
+                removed += 1
+        return removed
+
+    def _compact(self):
+        self._expiry = [
+            (entry.expires_at, next(self._counter), key)
+            for key, entry in self._cache.items()
+            if entry.expires_at is not None
+        ]
+        heapq.heapify(self._expiry)
+
+
+def _is_expired(entry: CacheEntry, now: float) -> bool:
+    return entry.expires_at is not None and entry.expires_at <= now
+
+
+async def _sweep_forever(interval: float):
+    while True:
+        for cache in list(_caches):
+            # Expire in batches so a large backlog doesn't hog the loop.
+            while cache.sweep(limit=10_000) >= 10_000:
+                await sleep(0)
+        await sleep(interval)
+
+
+async def start_sweeper(interval: float = 1.0):
+    """ Starts the one sweeper task that expires keys of every TTLCache """
+    global _sweeper
 
-def ttl_cache(key_name: str, ttl: Optional[float] = None):
-    cache = TTLCache(ttl)
+    if _sweeper is None or _sweeper.done():
+        _sweeper = get_event_loop().create_task(_sweep_forever(interval))
+
+
+async def stop_sweeper():
+    global _sweeper
+
+    if _sweeper is not None:
+        _sweeper.cancel()
+        try:
+            await _sweeper
+        except CancelledError:
+            pass
+        _sweeper = None
+
+
+class _CachedError:
+    __slots__ = ("exception",)
+
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def _key_builder(func: Callable, key_name: Optional[str]) -> Callable:
+    """
+    Makes a function that turns the call arguments of `func` into a cache
+    key, either the single argument called `key_name` or every argument
+    when no name is given, arguments are matched the same way python
+    would so it doesn't matter if they are passed positionally or not.
+    """
+    signature = inspect.signature(func)
+
+    def build(args: tuple, kwargs: dict) -> Any:
+        if key_name is not None and key_name in kwargs:
+            return kwargs[key_name]
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        if key_name is not None:
+            return bound.arguments[key_name]
+        return tuple(bound.arguments.items())
+
+    return build
+
+
+def ttl_cache(key_name: Optional[str] = None, ttl: Optional[float] = None, max_size: Optional[int] = None):
+    cache = TTLCache(ttl, max_size)
 
     def wrapper(func):
+        build_key = _key_builder(func, key_name)
+
+        @wraps(func)
         def wrap_cache(*args, **kwargs):
-            key = kwargs[key_name]
+            key = build_key(args, kwargs)
 
             try:
                 value = cache.get(key)
@@ -57,24 +244,91 @@ def ttl_cache(key_name: str, ttl: Optional[float] = None):
                 value = func(*args, **kwargs)
                 cache.set(key, value)
             return value
+
+        wrap_cache.cache = cache
         return wrap_cache
     return wrapper
 
 
-def async_ttl_cache(key_name: str, ttl: Optional[float] = None):
-    cache = TTLCache(ttl)
+def async_ttl_cache(
+    key_name: Optional[str] = None,
+    ttl: Optional[float] = None,
+    max_size: Optional[int] = None,
+    stale_ttl: Optional[float] = None,
+    error_ttl: Optional[float] = None,
+):
+    """
+    Caches the results of a coroutine function for `ttl` seconds.
+
+    Concurrent misses for the same key share one in-flight call instead of
+    each calling the wrapped function, the call is shielded so a caller
+    going away doesn't cancel it for everyone else.
+
+    With `stale_ttl` an expired value keeps being returned for that many
+    more seconds while a single background call refreshes it, with
+    `error_ttl` an exception raised by the wrapped function is cached and
+    re-raised for that many seconds instead of calling it again.
+    """
+    hard_ttl = ttl
+    if stale_ttl is not None and ttl is not None:
+        hard_ttl = ttl + stale_ttl
+
+    cache = TTLCache(hard_ttl, max_size)
+    in_flight: Dict[Any, Future] = {}
 
     def wrapper(func):
+        build_key = _key_builder(func, key_name)
+
+        async def load(key: Any, args: tuple, kwargs: dict) -> Any:
+            try:
+                value = await func(*args, **kwargs)
+            except Exception as e:
+                # A stale value is still better than a cached error.
+                if error_ttl is not None and key not in cache:
+                    cache.set(key, _CachedError(e), ttl=error_ttl)
+                raise
+
+            if stale_ttl is not None and ttl is not None:
+                cache.set(key, (monotonic() + ttl, value))
+            else:
+                cache.set(key, value)
+            return value
+
+        def done(key: Any, task: Future):
+            if in_flight.get(key) is task:
+                del in_flight[key]
+
+            # Marks the exception as retrieved for refreshes nobody awaits.
+            if not task.cancelled():
+                task.exception()
+
+        def refresh(key: Any, args: tuple, kwargs: dict) -> Future:
+            task = in_flight.get(key)
+            if task is None:
+                task = ensure_future(load(key, args, kwargs))
+                task.add_done_callback(partial(done, key))
+                in_flight[key] = task
+            return task
+
+        @wraps(func)
         async def wrap_cache(*args, **kwargs):
-            key = kwargs[key_name]
+            key = build_key(args, kwargs)
 
             try:
                 value = cache.get(key)
             except KeyError:
-                value = await func(*args, **kwargs)
-                cache.set(key, value)
+                return await shield(refresh(key, args, kwargs))
+
+            if isinstance(value, _CachedError):
+                raise value.exception
+
+            if stale_ttl is not None and ttl is not None:
+                fresh_until, value = value
+                if fresh_until <= monotonic():
+                    refresh(key, args, kwargs)
             return value
 
+        wrap_cache.cache = cache
         return wrap_cache
 
     return wrapper
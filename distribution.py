@@ -1,3 +1,14 @@
+import asyncio
+import logging
+
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from utils.http import HttpClient, LIVE_SERVER
+from utils.settings import LiveServerSettings
+
+
+logger = logging.getLogger(__name__)
+
 
 class LiveServer:
     def __init__(
@@ -5,19 +16,262 @@ class LiveServer:
             id: str,
             rtmp_domain: str,
             control_domain: str,
+            capacity: int = 100,
+            region: Optional[str] = None,
+            control_scheme: str = "https",
+            draining: bool = False,
     ):
         self.id = id
-        self.control = f"https://{control_domain}"
+        self.control = f"{control_scheme}://{control_domain}"
         self.rtmp = f"rtmp://{rtmp_domain}/live"
 
+        # Servers are named <region>-<n>, e.g. us-1
+        self.region = region or id.rsplit("-", 1)[0]
+        self.capacity = capacity
+
+        # Draining as configured in the settings file and as set through the
+        # admin api, the admin's choice wins and outlives settings reloads.
+        self.configured_draining = draining
+        self.drain_override: Optional[bool] = None
+
+        self.rooms = 0
+        self.healthy = True
+        self.failures = 0
+
+    def __repr__(self):
+        return f"LiveServer(id={self.id!r}, rooms={self.rooms}, healthy={self.healthy})"
+
+    @classmethod
+    def from_settings(cls, settings: LiveServerSettings) -> "LiveServer":
+        return cls(
+            settings.id,
+            settings.rtmp_domain,
+            settings.control_domain,
+            capacity=settings.capacity,
+            region=settings.region,
+            control_scheme=settings.control_scheme,
+            draining=settings.draining,
+        )
+
+    def update(self, settings: LiveServerSettings):
+        """ Applies new settings keeping the room count and health """
+        other = self.from_settings(settings)
+        self.control = other.control
+        self.rtmp = other.rtmp
+        self.region = other.region
+        self.capacity = other.capacity
+        self.configured_draining = other.configured_draining
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "region": self.region,
+            "rtmp": self.rtmp,
+            "control": self.control,
+            "rooms": self.rooms,
+            "capacity": self.capacity,
+            "healthy": self.healthy,
+            "draining": self.draining,
+            "drain_override": self.drain_override,
+        }
+
+    @property
+    def draining(self) -> bool:
+        if self.drain_override is not None:
+            return self.drain_override
+        return self.configured_draining
+
+    @property
+    def load(self) -> float:
+        if self.capacity <= 0:
+            return float("inf")
+        return self.rooms / self.capacity
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and not self.draining and self.rooms < self.capacity
+
 
 class LiveServerManager:
-    def __init__(self, default: LiveServer):
+    """
+    Keeps track of every live server and decides which one new rooms go on.
+
+    Rooms are placed on the least loaded healthy server, a preferred server
+    id is used if it can take the room and otherwise narrows the choice
+    down to servers in the same region.
+
+    Once started, every server's control endpoint is polled in the
+    background for its health and load, a server failing `max_failures`
+    polls in a row is taken out of rotation until it answers again.
+    """
+
+    def __init__(
+            self,
+            default: Optional[LiveServer] = None,
+            http: Optional[HttpClient] = None,
+            authorization: str = "",
+            poll_interval: float = 10.0,
+            max_failures: int = 3,
+    ):
         self.default = default
         self.selectable_urls = {}
+        if default is not None:
+            self.selectable_urls[default.id] = default
+
+        self._http = http
+        self._authorization = authorization
+        self._poll_interval = poll_interval
+        self._max_failures = max_failures
+        self._task: Optional[asyncio.Task] = None
+
+        # Returns the amount of rooms stored per live server id, set by the
+        # room store once it is connected.
+        self.count_rooms: Optional[Callable[[], Awaitable[Dict[str, int]]]] = None
+
+    @property
+    def servers(self) -> List[LiveServer]:
+        return list(self.selectable_urls.values())
 
     def get(self, sub_domain=None) -> LiveServer:
         return self.selectable_urls.get(sub_domain, self.default)
 
     def add_server(self, server: LiveServer):
         self.selectable_urls[server.id] = server
+
+    def configure(self, servers: List[LiveServerSettings], default: str):
+        """
+        Brings the fleet in line with the given settings, known servers are
+        updated in place and servers no longer listed are drained rather
+        than removed so the rooms already on them keep working.
+        """
+        listed = set()
+        for settings in servers:
+            listed.add(settings.id)
+            server = self.selectable_urls.get(settings.id)
+            if server is None:
+                self.add_server(LiveServer.from_settings(settings))
+            else:
+                server.update(settings)
+
+        for server in self.servers:
+            if server.id not in listed:
+                server.configured_draining = True
+                server.drain_override = None
+
+        if default in self.selectable_urls:
+            self.default = self.selectable_urls[default]
+        elif self.default is None and servers:
+            self.default = self.selectable_urls[servers[0].id]
+
+    def drain(self, server_id: str, draining: bool = True) -> bool:
+        """
+        Stops (or restarts) placing new rooms on a server, this holds over
+        reloads of the settings file until it is set back to what the file
+        says or the server is taken out of the file.
+        """
+        server = self.selectable_urls.get(server_id)
+        if server is None:
+            return False
+
+        server.drain_override = None if draining == server.configured_draining else draining
+        return True
+
+    def place(self, preferred: Optional[str] = None) -> LiveServer:
+        """ Picks the server for a new room and counts the room against it """
+        candidates = [server for server in self.servers if server.available]
+
+        if preferred is not None:
+            server = self.selectable_urls.get(preferred)
+            if server is not None and server.available:
+                candidates = [server]
+            else:
+                region = server.region if server is not None else preferred
+                in_region = [s for s in candidates if s.region == region]
+                candidates = in_region or candidates
+
+        if not candidates:
+            # Everything is full or down, overfill the healthy servers
+            # rather than refusing to make rooms.
+            candidates = [s for s in self.servers if s.healthy and not s.draining]
+            candidates = candidates or [self.default]
+
+        server = min(candidates, key=lambda s: (s.load, s.id))
+        server.rooms += 1
+        return server
+
+    def release(self, server_id: str):
+        """ Marks a room as gone from the given server """
+        server = self.selectable_urls.get(server_id)
+        if server is not None and server.rooms > 0:
+            server.rooms -= 1
+
+    def report_failure(self, server_id: str):
+        """ Counts a failed call to a server the same as a failed poll """
+        server = self.selectable_urls.get(server_id)
+        if server is not None:
+            self._mark_failed(server)
+
+    def _mark_failed(self, server: LiveServer):
+        server.failures += 1
+        if server.failures >= self._max_failures:
+            server.healthy = False
+
+    async def refresh_counts(self):
+        """ Resyncs the room counts with the room store """
+        if self.count_rooms is None:
+            return
+
+        counts = await self.count_rooms()
+        for server in self.servers:
+            server.rooms = counts.get(server.id, 0)
+
+    async def poll(self, server: LiveServer):
+        url = f"{server.control}/control/stats" \
+              f"?authorization={self._authorization}"
+        try:
+            async with self._http.get(LIVE_SERVER, url, timeout=5) as resp:
+                resp.raise_for_status()
+                stats = await resp.json()
+            if not isinstance(stats, dict):
+                raise ValueError(f"expected a json object, got {stats!r}")
+        except Exception:
+            self._mark_failed(server)
+            return
+
+        server.failures = 0
+        server.healthy = True
+
+        capacity = stats.get("capacity")
+        if isinstance(capacity, int):
+            server.capacity = capacity
+
+    async def poll_all(self):
+        try:
+            await self.refresh_counts()
+        except Exception:
+            pass
+
+        await asyncio.gather(*(self.poll(server) for server in self.servers))
+
+    async def _poll_forever(self):
+        while True:
+            try:
+                await self.poll_all()
+            except Exception:
+                # Polling has to outlive any one bad round or the fleet's
+                # health would never change again.
+                logger.exception("polling the live servers failed")
+            await asyncio.sleep(self._poll_interval)
+
+    async def start(self):
+        if self._http is not None and self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._poll_forever())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
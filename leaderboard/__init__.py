@@ -0,0 +1,4 @@
+from .index import RankedIndex
+from .boards import Board, Entry, Leaderboards, MEMBERS, GUILDS, make_cursor, parse_cursor
+from .snapshot import Snapshot, write_snapshot
+from .seasons import Seasons
@@ -0,0 +1,176 @@
+import asyncio
+
+from typing import Dict, List, Optional, Tuple
+
+from . import store
+from .index import RankedIndex
+
+
+MEMBERS = "members"
+GUILDS = "guilds"
+
+
+class Entry:
+    __slots__ = ("id", "name", "icon", "invite")
+
+    def __init__(self, id: str, name: Optional[str], icon: Optional[str], invite: Optional[str]):
+        self.id = id
+        self.name = name
+        self.icon = icon
+        self.invite = invite
+
+
+class Board:
+    """
+    One leaderboard held in memory, the ranked index of points along with
+    the details shown next to every entry.
+
+    `version` is the highest store version applied so far, rows are only
+    ever applied in full (points are absolute) so seeing one twice is fine.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.index = RankedIndex()
+        self.entries: Dict[str, Entry] = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def apply(self, rows: List[store.Row]):
+        for entry_id, name, icon, invite, points, version in rows:
+            self.entries[entry_id] = Entry(entry_id, name, icon, invite)
+            self.index.set(entry_id, points)
+
+    def _describe(self, rank: int, entry_id: str, points: int) -> dict:
+        entry = self.entries.get(entry_id)
+        return {
+            "rank": rank + 1,
+            "id": entry_id,
+            "name": entry and entry.name,
+            "icon": entry and entry.icon,
+            "invite": entry and entry.invite,
+            "points": points,
+        }
+
+    def top(self, count: int) -> List[dict]:
+        return self.range(0, count)
+
+    def range(self, start: int, count: int) -> List[dict]:
+        return [
+            self._describe(start + i, entry_id, points)
+            for i, (entry_id, points) in enumerate(self.index.range(start, count))
+        ]
+
+    def get(self, entry_id: str) -> Optional[dict]:
+        rank = self.index.rank(entry_id)
+        if rank is None:
+            return None
+        return self._describe(rank, entry_id, self.index.score(entry_id))
+
+    def page(self, cursor: Optional[str], count: int, start: int = 0) -> Tuple[List[dict], Optional[str]]:
+        """
+        Up to `count` entries after the cursor (or from rank `start` without
+        one) and the cursor of the next page, None once the end is reached.
+
+        A cursor is the points and id of the last entry shown, so paging on
+        while scores change neither skips nor repeats entries the way an
+        offset would.
+        """
+        if cursor is None:
+            entries = self.range(start, count)
+        else:
+            points, entry_id = parse_cursor(cursor)
+            pairs = self.index.after(points, entry_id, count)
+            first = self.index.rank(pairs[0][0]) if pairs else 0
+            entries = [
+                self._describe(first + i, pair_id, pair_points)
+                for i, (pair_id, pair_points) in enumerate(pairs)
+            ]
+
+        if len(entries) < count:
+            return entries, None
+        last = entries[-1]
+        return entries, make_cursor(last["points"], last["id"])
+
+
+def make_cursor(points: int, entry_id: str) -> str:
+    return f"{points}_{entry_id}"
+
+
+def parse_cursor(cursor: str) -> Tuple[int, str]:
+    """ Raises ValueError for a malformed cursor """
+    points, sep, entry_id = cursor.partition("_")
+    if not sep or not entry_id:
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return int(points), entry_id
+
+
+class Leaderboards:
+    """
+    The member and guild leaderboards of this worker.
+
+    Every board is loaded from the store on start, score updates are
+    written to the store and applied straight away, changes made through
+    other workers are picked up every `sync_interval` seconds by reading the
+    rows with a newer version than the board has seen.
+    """
+
+    def __init__(self, path: str = "leaderboard.db", sync_interval: float = 1.0):
+        self._path = path
+        self._sync_interval = sync_interval
+        self._task: Optional[asyncio.Task] = None
+        self.boards: Dict[str, Board] = {name: Board(name) for name in (MEMBERS, GUILDS)}
+
+    def get(self, name: str) -> Optional[Board]:
+        return self.boards.get(name)
+
+    async def start(self):
+        await store.connect(self._path)
+        for board in self.boards.values():
+            scores = []
+            entries = {}
+            async for rows in store.load(board.name):
+                for entry_id, name, icon, invite, points, version in rows:
+                    scores.append((entry_id, points))
+                    entries[entry_id] = Entry(entry_id, name, icon, invite)
+                    board.version = max(board.version, version)
+
+            board.entries = entries
+            board.index.load(scores)
+
+        if self._sync_interval:
+            self._task = asyncio.get_event_loop().create_task(self._sync_forever())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await store.close()
+
+    async def update(self, board: Board, updates: List[tuple]) -> List[store.Row]:
+        rows = await store.apply_updates(board.name, updates)
+        board.apply(rows)
+        return rows
+
+    async def sync(self):
+        for board in self.boards.values():
+            rows = await store.changed_since(board.name, board.version)
+            if rows:
+                board.apply(rows)
+                board.version = rows[-1][-1]
+
+    async def _sync_forever(self):
+        while True:
+            await asyncio.sleep(self._sync_interval)
+            try:
+                await self.sync()
+            except Exception:
+                # The database is busy or gone for a moment, try again later.
+                pass
@@ -0,0 +1,217 @@
+import random
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# Enough levels to stay O(log n) well past a hundred million entries.
+MAX_LEVELS = 28
+
+Key = Tuple[int, str]
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Optional[Key], levels: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * levels
+        # How many level 0 steps the link at each level skips over.
+        self.width: List[int] = [1] * levels
+
+
+class RankedIndex:
+    """
+    Scores by id kept in rank order, highest score first and ties broken by
+    id, in an indexable skiplist.
+
+    Setting a score, finding an id's rank and reading the entries at any
+    rank (or after any entry, for cursor pagination) are all O(log n).
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self._head = _Node(None, MAX_LEVELS)
+        self._scores: Dict[str, int] = {}
+        self._random = random.Random(seed)
+
+        # Only the levels some node reaches are walked, the head's widths
+        # above them are set when a level is first used.
+        self._top = 1
+        self._size = 0
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, entry_id: str):
+        return entry_id in self._scores
+
+    @staticmethod
+    def key(entry_id: str, score: int) -> Key:
+        return -score, entry_id
+
+    def score(self, entry_id: str) -> Optional[int]:
+        return self._scores.get(entry_id)
+
+    def load(self, entries: Iterable[Tuple[str, int]]):
+        """
+        Replaces the whole index, building it from sorted keys in one pass
+        is a lot quicker than setting millions of scores one by one.
+        """
+        self._scores = dict(entries)
+        self._head = _Node(None, MAX_LEVELS)
+        self._top = 1
+        self._size = len(self._scores)
+
+        last = [self._head] * MAX_LEVELS
+        last_position = [0] * MAX_LEVELS
+        keys = sorted(self.key(entry_id, score) for entry_id, score in self._scores.items())
+        for position, key in enumerate(keys, 1):
+            levels = self._levels()
+            node = _Node(key, levels)
+            for level in range(levels):
+                prev = last[level]
+                prev.next[level] = node
+                prev.width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+            if levels > self._top:
+                self._top = levels
+
+        for level in range(self._top):
+            last[level].width[level] = self._size + 1 - last_position[level]
+
+    def set(self, entry_id: str, score: int):
+        old = self._scores.get(entry_id)
+        if old == score:
+            return
+
+        if old is not None:
+            self._remove(self.key(entry_id, old))
+        self._insert(self.key(entry_id, score))
+        self._scores[entry_id] = score
+
+    def add(self, entry_id: str, delta: int) -> int:
+        score = self._scores.get(entry_id, 0) + delta
+        self.set(entry_id, score)
+        return score
+
+    def remove(self, entry_id: str):
+        score = self._scores.pop(entry_id, None)
+        if score is not None:
+            self._remove(self.key(entry_id, score))
+
+    def rank(self, entry_id: str) -> Optional[int]:
+        """ The 0 based rank of an id or None if it has no score """
+        score = self._scores.get(entry_id)
+        if score is None:
+            return None
+        return self._position(self.key(entry_id, score))
+
+    def range(self, start: int, count: int) -> List[Tuple[str, int]]:
+        """ Up to `count` (id, score) pairs starting at the 0 based rank `start` """
+        if start < 0 or start >= len(self._scores) or count <= 0:
+            return []
+        return list(self._iter_from(self._node_at(start), count))
+
+    def after(self, score: int, entry_id: str, count: int) -> List[Tuple[str, int]]:
+        """
+        Up to `count` pairs ranked below the given score and id, the entry
+        doesn't need to still exist so cursors survive score changes.
+        """
+        start = self._position(self.key(entry_id, score), inclusive=True)
+        return self.range(start, count)
+
+    def _position(self, key: Key, inclusive: bool = False) -> int:
+        """ How many keys sort before `key` (or are equal to it if inclusive) """
+        node = self._head
+        position = 0
+        for level in reversed(range(self._top)):
+            nxt = node.next[level]
+            while nxt is not None and (nxt.key <= key if inclusive else nxt.key < key):
+                position += node.width[level]
+                node = nxt
+                nxt = node.next[level]
+        return position
+
+    def _node_at(self, index: int) -> _Node:
+        node = self._head
+        index += 1
+        for level in reversed(range(self._top)):
+            while node.next[level] is not None and node.width[level] <= index:
+                index -= node.width[level]
+                node = node.next[level]
+        return node
+
+    @staticmethod
+    def _iter_from(node: _Node, count: int) -> Iterator[Tuple[str, int]]:
+        while node is not None and count > 0:
+            score, entry_id = node.key
+            yield entry_id, -score
+            node = node.next[0]
+            count -= 1
+
+    def _levels(self) -> int:
+        levels = 1
+        while levels < MAX_LEVELS and self._random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def _insert(self, key: Key):
+        levels = self._levels()
+        if levels > self._top:
+            for level in range(self._top, levels):
+                self._head.next[level] = None
+                self._head.width[level] = self._size + 1
+            self._top = levels
+
+        chain = [self._head] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+
+        node = self._head
+        for level in reversed(range(self._top)):
+            nxt = node.next[level]
+            while nxt is not None and nxt.key < key:
+                steps_at_level[level] += node.width[level]
+                node = nxt
+                nxt = node.next[level]
+            chain[level] = node
+
+        new = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+
+        for level in range(levels, self._top):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def _remove(self, key: Key):
+        chain = [self._head] * MAX_LEVELS
+
+        node = self._head
+        for level in reversed(range(self._top)):
+            nxt = node.next[level]
+            while nxt is not None and nxt.key < key:
+                node = nxt
+                nxt = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+
+        for level in range(len(target.next), self._top):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+        while self._top > 1 and self._head.next[self._top - 1] is None:
+            self._top -= 1
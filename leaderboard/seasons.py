@@ -0,0 +1,105 @@
+import os
+import re
+import errno
+import shutil
+import asyncio
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+from .boards import Board
+from .snapshot import Snapshot, write_snapshot
+
+
+SEASON_NAME = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+
+class Seasons:
+    """
+    Finished seasons, each board frozen into `<directory>/<season>/<board>.lb`
+    when the season ends. Snapshots never change once written so they are
+    opened once and read straight from the memory mapped file after that.
+    """
+
+    def __init__(self, directory: str = "./seasons"):
+        self._directory = directory
+        self._snapshots: Dict[Tuple[str, str], Snapshot] = {}
+
+    def list(self) -> List[str]:
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if SEASON_NAME.match(name))
+
+    def _path(self, season: str, board: str) -> str:
+        return os.path.join(self._directory, season, f"{board}.lb")
+
+    def _publish(self, tmp: str, directory: str):
+        try:
+            os.rename(tmp, directory)
+        except OSError as e:
+            # Another freeze of the same season finished first.
+            if e.errno in (errno.EEXIST, errno.ENOTEMPTY):
+                raise FileExistsError(f"season directory {directory!r} already exists") from e
+            raise
+
+    def get(self, season: str, board: str) -> Optional[Snapshot]:
+        snapshot = self._snapshots.get((season, board))
+        if snapshot is not None:
+            return snapshot
+
+        if not SEASON_NAME.match(season):
+            return None
+
+        try:
+            snapshot = Snapshot(self._path(season, board))
+        except FileNotFoundError:
+            return None
+
+        self._snapshots[(season, board)] = snapshot
+        return snapshot
+
+    async def freeze(self, season: str, boards: Iterable[Board]):
+        """
+        Snapshots every board as the given season, raises ValueError for a
+        bad season name and FileExistsError if the season already exists.
+        """
+        if not SEASON_NAME.match(season):
+            raise ValueError(f"invalid season name {season!r}")
+
+        directory = os.path.join(self._directory, season)
+        if os.path.exists(directory):
+            raise FileExistsError(f"season directory {directory!r} already exists")
+
+        # Written into a hidden directory, which `list` skips, and renamed
+        # into place once every board is in so a failed freeze leaves no
+        # half written season behind and can be retried.
+        os.makedirs(self._directory, exist_ok=True)
+        tmp = os.path.join(self._directory, f".{season}.{uuid4().hex}")
+        os.mkdir(tmp)
+
+        loop = asyncio.get_event_loop()
+        try:
+            for board in boards:
+                # Taken on the loop so the board can't change half way through,
+                # entries are replaced rather than changed so reading them from
+                # the writer thread afterwards is safe.
+                pairs = board.index.range(0, len(board.index))
+                entries = [board.entries.get(entry_id) for entry_id, _ in pairs]
+                await loop.run_in_executor(
+                    None,
+                    write_snapshot,
+                    os.path.join(tmp, f"{board.name}.lb"),
+                    pairs,
+                    entries,
+                )
+            self._publish(tmp, directory)
+        except BaseException:
+            await loop.run_in_executor(None, shutil.rmtree, tmp, True)
+            raise
+
+    def close(self):
+        for snapshot in self._snapshots.values():
+            snapshot.close()
+        self._snapshots.clear()
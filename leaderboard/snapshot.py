@@ -0,0 +1,158 @@
+import os
+import mmap
+import struct
+import orjson
+
+from typing import List, Optional, Tuple
+
+from .boards import Entry, make_cursor, parse_cursor
+
+
+MAGIC = b"SPLB"
+FORMAT_VERSION = 1
+
+# magic, format version, entry count, offset of the id index, offset of the strings
+HEADER = struct.Struct("<4sHIQQ")
+# points, id offset, id length, details offset, details length
+RANK_RECORD = struct.Struct("<qIHII")
+# rank of the entry, records are in id order
+INDEX_RECORD = struct.Struct("<I")
+
+
+def write_snapshot(path: str, pairs: List[Tuple[str, int]], entries: List[Optional[Entry]]):
+    """
+    Freezes a board, its (id, points) pairs in rank order and the details
+    of each, into a snapshot file.
+
+    The file is a header, one fixed size record per entry in rank order,
+    the ranks again sorted by entry id to look ids up with a binary search
+    and finally the ids and details the records point into. It is written
+    next to `path` first and moved over it so readers never see half a file.
+    """
+    strings = bytearray()
+    records = []
+    ids = []
+    for (entry_id, points), entry in zip(pairs, entries):
+        raw_id = entry_id.encode()
+        id_offset = len(strings)
+        strings += raw_id
+
+        details = orjson.dumps({
+            "name": entry and entry.name,
+            "icon": entry and entry.icon,
+            "invite": entry and entry.invite,
+        })
+        details_offset = len(strings)
+        strings += details
+
+        records.append(RANK_RECORD.pack(points, id_offset, len(raw_id), details_offset, len(details)))
+        ids.append(raw_id)
+
+    by_id = sorted(range(len(ids)), key=ids.__getitem__)
+
+    index_offset = HEADER.size + RANK_RECORD.size * len(records)
+    strings_offset = index_offset + INDEX_RECORD.size * len(by_id)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(records), index_offset, strings_offset))
+        file.writelines(records)
+        file.writelines(INDEX_RECORD.pack(rank) for rank in by_id)
+        file.write(strings)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+class Snapshot:
+    """
+    A read only board backed by a memory mapped snapshot file, only the
+    pages of the file that are read are ever loaded and they are shared by
+    every worker through the page cache.
+
+    Has the same read methods as Board so pages can be rendered from either.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self._count, self._index_offset, self._strings_offset = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a leaderboard snapshot")
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
+
+    def _record(self, rank: int) -> Tuple[int, int, int, int, int]:
+        return RANK_RECORD.unpack_from(self._map, HEADER.size + RANK_RECORD.size * rank)
+
+    def _id(self, rank: int) -> bytes:
+        _, id_offset, id_length, _, _ = self._record(rank)
+        start = self._strings_offset + id_offset
+        return self._map[start:start + id_length]
+
+    def _describe(self, rank: int) -> dict:
+        points, id_offset, id_length, details_offset, details_length = self._record(rank)
+        start = self._strings_offset
+        details = orjson.loads(self._map[start + details_offset:start + details_offset + details_length])
+        return {
+            "rank": rank + 1,
+            "id": self._map[start + id_offset:start + id_offset + id_length].decode(),
+            **details,
+            "points": points,
+        }
+
+    def range(self, start: int, count: int) -> List[dict]:
+        start = max(start, 0)
+        return [self._describe(rank) for rank in range(start, min(start + count, self._count))]
+
+    def top(self, count: int) -> List[dict]:
+        return self.range(0, count)
+
+    def rank(self, entry_id: str) -> Optional[int]:
+        """ The 0 based rank of an id, found with a binary search of the id index """
+        raw_id = entry_id.encode()
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            rank, = INDEX_RECORD.unpack_from(self._map, self._index_offset + INDEX_RECORD.size * middle)
+            found = self._id(rank)
+            if found == raw_id:
+                return rank
+            if found < raw_id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get(self, entry_id: str) -> Optional[dict]:
+        rank = self.rank(entry_id)
+        return None if rank is None else self._describe(rank)
+
+    def _after(self, points: int, entry_id: str) -> int:
+        """ The rank of the first entry sorting after the given points and id """
+        key = (-points, entry_id.encode())
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if (-self._record(middle)[0], self._id(middle)) <= key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def page(self, cursor: Optional[str], count: int, start: int = 0) -> Tuple[List[dict], Optional[str]]:
+        if cursor is not None:
+            start = self._after(*parse_cursor(cursor))
+
+        entries = self.range(start, count)
+        if len(entries) < count:
+            return entries, None
+        last = entries[-1]
+        return entries, make_cursor(last["points"], last["id"])
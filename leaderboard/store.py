@@ -0,0 +1,136 @@
+import asyncio
+import aiosqlite
+
+from typing import AsyncIterator, List, Optional, Tuple
+
+
+# One row of a board: (entry_id, name, icon, invite, points, version)
+Row = Tuple[str, Optional[str], Optional[str], Optional[str], int, int]
+
+_conn: Optional[aiosqlite.Connection] = None
+# Every coroutine shares the connection and with it one transaction, writers
+# take turns so none of them starts, commits or rolls back another's.
+_write_lock = asyncio.Lock()
+
+
+async def connect(path: str = "leaderboard.db"):
+    """
+    Opens the leaderboard database, every change bumps the version of the
+    rows it touched to one past the highest version so far which is what
+    lets each worker pick up changes made by the others with `changed_since`.
+    """
+    global _conn
+
+    if _conn is not None:
+        return
+
+    conn = await aiosqlite.connect(path)
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute("PRAGMA synchronous=NORMAL")
+    await conn.execute("PRAGMA busy_timeout=5000")
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS scores(
+            board TEXT,
+            entry_id TEXT,
+            name TEXT,
+            icon TEXT,
+            invite TEXT,
+            points INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (board, entry_id)
+        )"""
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS scores_version ON scores(board, version)"
+    )
+    await conn.commit()
+    _conn = conn
+
+
+async def close():
+    global _conn
+
+    if _conn is not None:
+        await _conn.close()
+        _conn = None
+
+
+def _get_conn() -> aiosqlite.Connection:
+    if _conn is None:
+        raise RuntimeError("leaderboard store is not connected, call connect() first")
+    return _conn
+
+
+async def load(board: str, batch_size: int = 10000) -> AsyncIterator[List[Row]]:
+    """ Every row of a board, a batch at a time """
+    conn = _get_conn()
+    async with conn.execute(
+        """SELECT entry_id, name, icon, invite, points, version
+        FROM scores WHERE board = ?""",
+        (board,)
+    ) as cur:
+        while True:
+            rows = await cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+
+async def changed_since(board: str, version: int) -> List[Row]:
+    conn = _get_conn()
+    async with conn.execute(
+        """SELECT entry_id, name, icon, invite, points, version
+        FROM scores WHERE board = ? AND version > ?
+        ORDER BY version""",
+        (board, version)
+    ) as cur:
+        return await cur.fetchall()
+
+
+async def apply_updates(board: str, updates: List[tuple]) -> List[Row]:
+    """
+    Applies score updates in one transaction and returns the changed rows.
+
+    Each update is (entry_id, name, icon, invite, points, delta), a points
+    value replaces the score and otherwise delta is added to it, details
+    left as None keep their current value.
+    """
+    conn = _get_conn()
+    async with _write_lock:
+        # Taking the write lock up front keeps versions unique across workers.
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            async with conn.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM scores WHERE board = ?",
+                (board,)
+            ) as cur:
+                version, = await cur.fetchone()
+
+            await conn.executemany(
+                """INSERT INTO scores(board, entry_id, name, icon, invite, points, version)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, ?), ?)
+                ON CONFLICT(board, entry_id) DO UPDATE SET
+                    name = COALESCE(excluded.name, scores.name),
+                    icon = COALESCE(excluded.icon, scores.icon),
+                    invite = COALESCE(excluded.invite, scores.invite),
+                    points = COALESCE(?, scores.points + ?),
+                    version = excluded.version
+                """,
+                [
+                    (board, entry_id, name, icon, invite, points, delta, version, points, delta)
+                    for entry_id, name, icon, invite, points, delta in updates
+                ]
+            )
+
+            async with conn.execute(
+                """SELECT entry_id, name, icon, invite, points, version
+                FROM scores WHERE board = ? AND version = ?""",
+                (board, version)
+            ) as cur:
+                rows = await cur.fetchall()
+        except BaseException:
+            await conn.rollback()
+            raise
+
+        await conn.commit()
+        return rows
@@ -1,3 +1,9 @@
+import os
+import sys
+import time
+import signal
+import logging
+import traceback
 import uvicorn
 import typing as t
 import router
@@ -6,7 +12,7 @@ import multiprocessing as mp
 
 
 from fastapi import responses
-from server import Hades
+from server import Hades, SETTINGS, preload_templates
 from utils import load_settings
 
 
@@ -14,10 +20,23 @@ APP_FILES = [
     "api.auth",
     "api.rooms",
     "api.leaderboard",
-    "api.quick_links"
+    "api.quick_links",
+    "api.admin",
 ]
 
 
+# Workers dying this soon after being forked count as failing to start, they
+# are replaced after RESPAWN_DELAY seconds doubling up to MAX_RESPAWN_DELAY
+# and the server gives up after MAX_FAST_EXITS of them in a row.
+FAST_EXIT = 5.0
+RESPAWN_DELAY = 0.5
+MAX_RESPAWN_DELAY = 30.0
+MAX_FAST_EXITS = 10
+STARTUP_FAILURE = 3
+
+logger = logging.getLogger(__name__)
+
+
 with open('./templates/404.html', encoding="utf-8") as file:
     not_found_html = file.read()
 
@@ -31,7 +50,11 @@ def import_callback(app_: Hades, endpoint: t.Union[router.Endpoint, router.Webso
             methods=endpoint.methods,
             **endpoint.extra)
     else:
-        raise NotImplementedError
+        app_.add_api_websocket_route(
+            endpoint.route,
+            endpoint.callback,
+            name=endpoint.callback_name,
+        )
 
 
 async def on_404(_req, _exec):
@@ -47,13 +70,115 @@ app = Hades(
 )
 
 
-router = router.Router(app, APP_FILES, import_callback)
+router = router.Router(app, APP_FILES, import_callback, wrap_callback=app.metrics.instrument)
+preload_templates()
+
+
+def run_workers(config: uvicorn.Config, workers: int):
+    """
+    Pre-forks `workers` processes all serving the same listening socket.
+
+    Everything built at import time (settings, routes, compiled templates
+    and static pages) is loaded once here and shared with the workers,
+    connections and clients are opened by each worker's startup hooks
+    after the fork. Workers that die are replaced until we are told to stop.
+
+    A worker that dies within FAST_EXIT seconds of starting most likely
+    can't start at all (bad settings, an unopenable database), those are
+    replaced after a growing delay and after MAX_FAST_EXITS in a row we
+    give up rather than forking in a loop.
+    """
+    sock = config.bind_socket()
+    children: t.Dict[int, float] = {}
+    stopping = False
+    fast_exits = 0
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 1
+            try:
+                server = uvicorn.Server(config)
+                server.run(sockets=[sock])
+                code = 0 if server.started else STARTUP_FAILURE
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(_signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    for _ in range(workers):
+        spawn()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        started = children.pop(pid, None)
+        if stopping:
+            continue
+
+        code = os.waitstatus_to_exitcode(status)
+        lived = time.monotonic() - started if started is not None else 0.0
+        logger.warning("worker %d exited with %s after %.1fs", pid, _describe_exit(code), lived)
+
+        if lived < FAST_EXIT:
+            fast_exits += 1
+        else:
+            fast_exits = 0
+
+        if fast_exits >= MAX_FAST_EXITS:
+            logger.error("%d workers in a row died on startup, giving up", fast_exits)
+            stop(None, None)
+            continue
+
+        if fast_exits:
+            time.sleep(min(RESPAWN_DELAY * 2 ** (fast_exits - 1), MAX_RESPAWN_DELAY))
+            if stopping:
+                continue
+        spawn()
+
+    sock.close()
+    if fast_exits >= MAX_FAST_EXITS:
+        sys.exit(STARTUP_FAILURE)
+
+
+def _describe_exit(code: int) -> str:
+    if code < 0:
+        return f"signal {signal.Signals(-code).name}"
+    return f"status {code}"
+
 
 if __name__ == '__main__':
-    uvicorn.run(
-        "main:app",
+    config = uvicorn.Config(
+        app,
         host="0.0.0.0",
         port=8080,
         log_level="info",
-        # workers=mp.cpu_count()
+        ws_ping_interval=SETTINGS.websocket_ping_interval,
+        ws_ping_timeout=SETTINGS.websocket_ping_timeout,
     )
+
+    # Snapshots left by the workers of an earlier run would be summed in.
+    app.metrics.clear()
+
+    workers = SETTINGS.workers or mp.cpu_count()
+    if workers > 1:
+        run_workers(config, workers)
+    else:
+        uvicorn.Server(config).run()
@@ -1 +1,20 @@
-from .store import get_room, set_room, delete_room
+from .store import (
+    Room,
+    RoomExistsError,
+    connect,
+    close,
+    attach_backend,
+    configure_cache,
+    cache_stats,
+    count_by_live_server,
+    get_room,
+    get_rooms,
+    insert_room,
+    insert_rooms,
+    reserve_room_ids,
+    set_room,
+    delete_room,
+    delete_rooms,
+)
+from .ids import RoomIdAllocator
+from .emit import EmitPipeline
@@ -0,0 +1,53 @@
+from typing import Any, Dict, Optional
+
+from cache import TTLCache
+
+
+_MISSING = object()
+
+
+class RoomCache:
+    """
+    A bounded read-through LRU of rooms keyed by room_id, rooms that do not
+    exist are remembered as well so repeated lookups of a bad id stay off
+    the database.
+
+    Every invalidation bumps the cache generation, a lookup only stores its
+    result if nothing was invalidated while it was reading from the database
+    which stops a slow read putting back a room that was just changed.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+
+        self._rooms = TTLCache(ttl, max_size)
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def get(self, room_id: str) -> Any:
+        """ Returns the cached room (or None) or `_MISSING` if not cached """
+        try:
+            return self._rooms.get(room_id)
+        except KeyError:
+            return _MISSING
+
+    def set(self, room_id: str, room: Any, generation: int):
+        if generation != self.generation or self.max_size <= 0:
+            return
+
+        self._rooms.set(room_id, room)
+
+    def invalidate(self, room_id: str):
+        self.generation += 1
+        self._rooms.delete(room_id)
+
+    def clear(self):
+        self.generation += 1
+        self._rooms.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {**self._rooms.stats, "max_size": self.max_size}
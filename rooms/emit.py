@@ -0,0 +1,231 @@
+import asyncio
+import logging
+
+from collections import deque
+from time import monotonic, perf_counter
+from typing import Any, Deque, Dict, List, Optional
+
+from utils.http import HttpClient, GATEWAY
+
+
+REJECT = "reject"
+DROP = "drop"
+
+# Responses meaning the gateway has no batch route at all.
+NO_BATCH_ROUTE = (404, 405)
+
+logger = logging.getLogger(__name__)
+
+
+class RoomQueue:
+    __slots__ = ("events", "ready", "task")
+
+    def __init__(self):
+        self.events: Deque[Any] = deque()
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class EmitPipeline:
+    """
+    Forwards room events to the gateway.
+
+    Every room gets a bounded queue drained in order by its own flusher
+    over the shared keep-alive session, so a busy room never holds a handler
+    up waiting on the gateway. A lone event is posted to `<url>/<room_id>`,
+    with `max_batch` above 1 whatever queued up while the last POST was in
+    flight goes to `<url>/<room_id>/batch` as a JSON list instead. If the
+    gateway turns out not to have that route the batch is sent one event
+    at a time and batching is turned off.
+
+    Events the gateway doesn't take are counted as lost, losses and drops
+    are logged as one summary at most every `report_interval` seconds.
+
+    Once a room's queue is full the gateway is falling behind, new events
+    are then either refused (`reject`, submit returns False) or the oldest
+    queued event is dropped to make room (`drop`).
+    """
+
+    def __init__(
+        self,
+        http: HttpClient,
+        url: str,
+        max_queue: int = 256,
+        max_batch: int = 1,
+        overflow: str = REJECT,
+        idle_timeout: float = 30.0,
+        report_interval: float = 60.0,
+    ):
+        if overflow not in (REJECT, DROP):
+            raise ValueError(f"unknown overflow policy {overflow!r}")
+
+        self._http = http
+        self._url = url.rstrip("/")
+        self._max_queue = max_queue
+        self._max_batch = max(1, max_batch)
+        self._overflow = overflow
+        self._idle_timeout = idle_timeout
+        self._rooms: Dict[str, RoomQueue] = {}
+
+        self._report_interval = report_interval
+        self._report_at = 0.0
+        self._reported_dropped = 0
+        self._reported_lost = 0
+        self._last_error: Optional[str] = None
+
+        self.submitted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.posts = 0
+        self.sent = 0
+        self.lost = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+
+    @property
+    def stats(self) -> dict:
+        depths = [len(queue.events) for queue in self._rooms.values()]
+        return {
+            "rooms": len(depths),
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "batching": self._max_batch > 1,
+            "posts": self.posts,
+            "sent": self.sent,
+            "lost": self.lost,
+            "flush_time": self.flush_time,
+            "max_flush_time": self.max_flush_time,
+        }
+
+    def depth(self, room_id: str) -> int:
+        queue = self._rooms.get(room_id)
+        return 0 if queue is None else len(queue.events)
+
+    def submit(self, room_id: str, event: Any) -> bool:
+        """ Queues an event, returns False if it was refused """
+        queue = self._rooms.get(room_id)
+        if queue is None:
+            queue = self._rooms[room_id] = RoomQueue()
+
+        if len(queue.events) >= self._max_queue:
+            if self._overflow == REJECT:
+                self.rejected += 1
+                return False
+
+            queue.events.popleft()
+            self.dropped += 1
+            self._report()
+
+        queue.events.append(event)
+        queue.ready.set()
+        self.submitted += 1
+
+        if queue.task is None:
+            queue.task = asyncio.get_event_loop().create_task(self._flush_forever(room_id, queue))
+        return True
+
+    async def _flush_forever(self, room_id: str, queue: RoomQueue):
+        try:
+            while True:
+                if not queue.events:
+                    queue.ready.clear()
+                    try:
+                        await asyncio.wait_for(queue.ready.wait(), self._idle_timeout)
+                    except asyncio.TimeoutError:
+                        # Nothing was said in a while, stop the flusher
+                        # until the room is used again.
+                        if not queue.events:
+                            return
+                        continue
+
+                batch = [
+                    queue.events.popleft()
+                    for _ in range(min(self._max_batch, len(queue.events)))
+                ]
+                await self._flush(room_id, batch)
+                self._report()
+        finally:
+            if self._rooms.get(room_id) is queue:
+                del self._rooms[room_id]
+
+    async def _flush(self, room_id: str, batch: List[Any]):
+        if len(batch) == 1:
+            await self._send(room_id, batch[0])
+            return
+
+        status = await self._post(f"{self._url}/{room_id}/batch", batch)
+        if status is None:
+            self.sent += len(batch)
+            return
+        if status not in NO_BATCH_ROUTE:
+            self.lost += len(batch)
+            return
+
+        # Either the gateway has no batch route or it doesn't know the room,
+        # if the events go through one by one it was the route.
+        sent = self.sent
+        for event in batch:
+            await self._send(room_id, event)
+        if self.sent > sent and self._max_batch > 1:
+            self._max_batch = 1
+            logger.warning("the gateway has no batch route, room events are now sent one at a time")
+
+    async def _send(self, room_id: str, event: Any):
+        if await self._post(f"{self._url}/{room_id}", event) is None:
+            self.sent += 1
+        else:
+            self.lost += 1
+
+    async def _post(self, url: str, payload: Any) -> Optional[int]:
+        """
+        Returns None once the gateway took the payload, otherwise the status
+        it answered with or 0 when there was no answer. The events are live
+        updates, ones the gateway didn't take are not worth sending late.
+        """
+        start = perf_counter()
+        try:
+            async with self._http.post(GATEWAY, url, json=payload) as resp:
+                if resp.status < 400:
+                    return None
+                self._last_error = f"{resp.status} {resp.reason}"
+                return resp.status
+        except Exception as e:
+            self._last_error = str(e) or type(e).__name__
+            return 0
+        finally:
+            elapsed = perf_counter() - start
+            self.posts += 1
+            self.flush_time += elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+
+    def _report(self, force: bool = False):
+        """ Logs the events dropped and lost since the last report """
+        now = monotonic()
+        if not force and now < self._report_at:
+            return
+
+        dropped = self.dropped - self._reported_dropped
+        lost = self.lost - self._reported_lost
+        if not dropped and not lost:
+            return
+
+        logger.warning(
+            "%d room events dropped from full queues and %d lost by the gateway (last error: %s)",
+            dropped,
+            lost,
+            self._last_error,
+        )
+        self._reported_dropped = self.dropped
+        self._reported_lost = self.lost
+        self._report_at = now + self._report_interval
+
+    async def close(self):
+        tasks = [queue.task for queue in self._rooms.values() if queue.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._rooms.clear()
+        self._report(force=True)
@@ -0,0 +1,74 @@
+import asyncio
+
+from collections import deque
+from typing import Deque, Optional
+
+from utils.generation import create_room_id
+from .store import reserve_room_ids
+
+
+class RoomIdAllocator:
+    """
+    Hands out unique room ids from a pool reserved in the room store ahead
+    of time, the pool is topped up in bulk in the background once it runs
+    low so creating a room doesn't wait on the database for its id.
+    """
+
+    def __init__(self, length: int = 5, batch_size: int = 64, low_water: int = 16):
+        self.length = length
+        self.batch_size = batch_size
+        self.low_water = low_water
+
+        self._pool: Deque[str] = deque()
+        self._refill: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._pool)
+
+    async def allocate(self) -> str:
+        while not self._pool:
+            await self._start_refill()
+
+        room_id = self._pool.popleft()
+        if len(self._pool) < self.low_water:
+            self._start_refill()
+        return room_id
+
+    def _start_refill(self) -> asyncio.Task:
+        if self._refill is None or self._refill.done():
+            self._refill = asyncio.ensure_future(self.refill())
+            # A failed background refill is retried by the next allocate,
+            # only a caller waiting on an empty pool sees the error.
+            self._refill.add_done_callback(_ignore_result)
+        return self._refill
+
+    async def close(self):
+        if self._refill is not None and not self._refill.done():
+            self._refill.cancel()
+            try:
+                await self._refill
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._refill = None
+
+    async def refill(self, attempts: int = 5):
+        """
+        Reserves up to `batch_size` more ids, as the id space fills up more
+        candidates collide so a few rounds are tried before giving up.
+        """
+        for _ in range(attempts):
+            candidates = {create_room_id(self.length) for _ in range(self.batch_size)}
+            reserved = await reserve_room_ids(list(candidates))
+            if reserved:
+                self._pool.extend(reserved)
+                return
+
+        raise RuntimeError(
+            f"could not reserve any room ids of length {self.length},"
+            f" the id space is close to full"
+        )
+
+
+def _ignore_result(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
@@ -1,19 +1,29 @@
+import asyncio
 import sqlite3
-from typing import Optional
+import aiosqlite
 
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
 
-conn = sqlite3.connect("rooms.db")
-conn.execute(
-    """CREATE TABLE IF NOT EXISTS rooms(
-        room_id TEXT UNIQUE PRIMARY KEY,
-        live_server_id TEXT,
-        webhook_url TEXT,
-        owner_id TEXT,
-        owner_name TEXT,
-        stream_name TEXT        
-    )"""
-)
-conn.commit()
+from cache import SharedBackend
+from .cache import RoomCache, _MISSING
+
+
+INVALIDATE_CHANNEL = "rooms:invalidate"
+
+# Stays well under sqlite's limit on the number of ? in one statement.
+MAX_VARIABLES = 500
+
+_conn: Optional[aiosqlite.Connection] = None
+# Every coroutine shares the connection and with it one transaction, writers
+# take turns so none of them commits or rolls back another's changes.
+_write_lock = asyncio.Lock()
+_cache = RoomCache()
+_backend: Optional[SharedBackend] = None
+
+
+class RoomExistsError(Exception):
+    pass
 
 
 class Room:
@@ -33,18 +43,274 @@ class Room:
         self.owner_name = owner_name
         self.stream_name = stream_name
 
+    def as_dict(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "live_server_id": self.live_server_id,
+            "webhook_url": self.webhook_url,
+            "owner_id": self.owner_id,
+            "owner_name": self.owner_name,
+            "stream_name": self.stream_name,
+        }
+
+
+async def connect(path: str = "rooms.db"):
+    """
+    Opens the room database, aiosqlite runs every statement on the
+    connection's own worker thread so none of the sqlite calls block the
+    event loop.
+
+    WAL mode lets readers carry on while a write is happening and with
+    `synchronous=NORMAL` a commit no longer waits on an fsync.
+    """
+    global _conn
+
+    if _conn is not None:
+        return
+
+    conn = await aiosqlite.connect(path)
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute("PRAGMA synchronous=NORMAL")
+    # Other workers may be holding the write lock, wait for it rather than
+    # failing straight away with "database is locked".
+    await conn.execute("PRAGMA busy_timeout=5000")
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS rooms(
+            room_id TEXT UNIQUE PRIMARY KEY,
+            live_server_id TEXT,
+            webhook_url TEXT,
+            owner_id TEXT,
+            owner_name TEXT,
+            stream_name TEXT
+        )"""
+    )
+    # Every room id ever handed out, ids are reserved here in bulk by
+    # reserve_room_ids before being used so they are never given out twice.
+    await conn.execute(
+        """CREATE TABLE IF NOT EXISTS room_ids(
+            room_id TEXT PRIMARY KEY,
+            token TEXT
+        )"""
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS room_ids_token ON room_ids(token)"
+    )
+    await conn.commit()
+    _conn = conn
+
+
+async def close():
+    global _conn, _backend
+
+    _backend = None
+    if _conn is not None:
+        await _conn.close()
+        _conn = None
+
+
+async def attach_backend(backend: SharedBackend):
+    """
+    Shares room invalidations with the other workers through `backend` so a
+    room changed by one worker is dropped from every worker's room cache.
+    """
+    global _backend
+
+    _backend = backend
+    await backend.subscribe(
+        INVALIDATE_CHANNEL,
+        lambda room_id: _cache.invalidate(room_id.decode()),
+    )
+
+
+async def _invalidate(room_id: str):
+    _cache.invalidate(room_id)
+    if _backend is not None:
+        await _backend.publish(INVALIDATE_CHANNEL, room_id.encode())
+
+
+def configure_cache(max_size: int, ttl: Optional[float]):
+    """ Replaces the room cache with one of the given size and ttl """
+    global _cache
+    _cache = RoomCache(max_size=max_size, ttl=ttl)
+
+
+def cache_stats() -> Dict[str, int]:
+    return _cache.stats
+
+
+def _get_conn() -> aiosqlite.Connection:
+    if _conn is None:
+        raise RuntimeError("room store is not connected, call connect() first")
+    return _conn
+
+
+async def get_room(room_id: str) -> Optional[Room]:
+    cache = _cache
+    room = cache.get(room_id)
+    if room is not _MISSING:
+        return room
+
+    generation = cache.generation
+    conn = _get_conn()
+    async with conn.execute(
+        "SELECT * FROM rooms WHERE room_id = ?",
+        (room_id,)
+    ) as cur:
+        maybe_room = await cur.fetchone()
+
+    room = None if maybe_room is None else Room(*maybe_room)
+    cache.set(room_id, room, generation)
+    return room
+
+
+def _chunks(items: List[str], size: int = MAX_VARIABLES) -> Iterable[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def get_rooms(room_ids: Iterable[str]) -> Dict[str, Optional[Room]]:
+    """
+    Looks up many rooms at once, rooms not in the cache are read with one
+    `IN (...)` query per few hundred ids. Missing rooms map to None.
+    """
+    cache = _cache
+    found: Dict[str, Optional[Room]] = {}
+    missing = []
+    for room_id in dict.fromkeys(room_ids):
+        room = cache.get(room_id)
+        if room is _MISSING:
+            missing.append(room_id)
+        else:
+            found[room_id] = room
+
+    if not missing:
+        return found
+
+    generation = cache.generation
+    conn = _get_conn()
+    for chunk in _chunks(missing):
+        placeholders = ", ".join("?" * len(chunk))
+        async with conn.execute(
+            f"SELECT * FROM rooms WHERE room_id IN ({placeholders})",
+            chunk
+        ) as cur:
+            for row in await cur.fetchall():
+                found[row[0]] = Room(*row)
 
-def get_room(room_id: str) -> Optional[Room]:
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE room_id = ?", (room_id,))
-    maybe_room = cur.fetchone()
-    cur.close()
-    if maybe_room is None:
-        return None
-    return Room(*maybe_room)
+    for room_id in missing:
+        room = found.setdefault(room_id, None)
+        cache.set(room_id, room, generation)
+    return found
 
 
-def set_room(
+async def count_by_live_server() -> Dict[str, int]:
+    """ The amount of rooms on each live server by live server id """
+    conn = _get_conn()
+    async with conn.execute(
+        "SELECT live_server_id, COUNT(*) FROM rooms GROUP BY live_server_id"
+    ) as cur:
+        return dict(await cur.fetchall())
+
+
+async def reserve_room_ids(candidates: List[str]) -> List[str]:
+    """
+    Reserves as many of the candidate ids as are free in one transaction
+    and returns the ones that were, ids already reserved by any worker or
+    used by an existing room are skipped.
+    """
+    token = uuid4().hex
+
+    conn = _get_conn()
+    async with _write_lock:
+        await conn.executemany(
+            """INSERT OR IGNORE INTO room_ids(room_id, token)
+            SELECT ?, ? WHERE NOT EXISTS (
+                SELECT 1 FROM rooms WHERE room_id = ?
+            )""",
+            [(room_id, token, room_id) for room_id in candidates]
+        )
+        await conn.commit()
+
+    async with conn.execute(
+        "SELECT room_id FROM room_ids WHERE token = ?",
+        (token,)
+    ) as cur:
+        return [row[0] for row in await cur.fetchall()]
+
+
+async def insert_room(
+    room_id: str,
+    live_server_id: str,
+    webhook: str,
+    owner_id: int,
+    owner_name: str,
+    stream_name: str,
+):
+    """ Adds a new room, unlike set_room this never overwrites a room """
+    conn = _get_conn()
+    async with _write_lock:
+        try:
+            await conn.execute(
+                """INSERT INTO rooms(
+                    room_id,
+                    live_server_id,
+                    webhook_url,
+                    owner_id,
+                    owner_name,
+                    stream_name
+                ) VALUES (?, ?, ?, ?, ?, ?)""",
+                (
+                    room_id,
+                    live_server_id,
+                    webhook,
+                    int(owner_id),
+                    owner_name,
+                    stream_name,
+                )
+            )
+        except sqlite3.IntegrityError:
+            await conn.rollback()
+            raise RoomExistsError(f"room {room_id!r} already exists")
+
+        await conn.commit()
+    await _invalidate(room_id)
+
+
+async def insert_rooms(rooms: List[Tuple[str, str, str, int, str, str]]):
+    """
+    Adds many new rooms in one transaction, each room is a tuple of the
+    arguments to insert_room. Either every room is added or none are.
+    """
+    if not rooms:
+        return
+
+    conn = _get_conn()
+    async with _write_lock:
+        try:
+            await conn.executemany(
+                """INSERT INTO rooms(
+                    room_id,
+                    live_server_id,
+                    webhook_url,
+                    owner_id,
+                    owner_name,
+                    stream_name
+                ) VALUES (?, ?, ?, ?, ?, ?)""",
+                [
+                    (room_id, live_server_id, webhook, int(owner_id), owner_name, stream_name)
+                    for room_id, live_server_id, webhook, owner_id, owner_name, stream_name in rooms
+                ]
+            )
+        except sqlite3.IntegrityError:
+            await conn.rollback()
+            raise RoomExistsError("one of the rooms already exists")
+
+        await conn.commit()
+    for room in rooms:
+        await _invalidate(room[0])
+
+
+async def set_room(
     room_id: str,
     live_server_id: str,
     webhook: str,
@@ -54,17 +320,24 @@ def set_room(
 ):
     owner_id = int(owner_id)
 
-    cur = conn.cursor()
-    try:
-        cur.execute(
+    conn = _get_conn()
+    async with _write_lock:
+        await conn.execute(
             """INSERT INTO rooms(
-                room_id, 
-                live_server_id, 
+                room_id,
+                live_server_id,
                 webhook_url,
                 owner_id,
                 owner_name,
                 stream_name
-            ) VALUES (?, ?, ?, ?, ?, ?)""",
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(room_id) DO UPDATE SET
+                live_server_id = excluded.live_server_id,
+                webhook_url = excluded.webhook_url,
+                owner_id = excluded.owner_id,
+                owner_name = excluded.owner_name,
+                stream_name = excluded.stream_name
+            """,
             (
                 room_id,
                 live_server_id,
@@ -74,36 +347,40 @@ def set_room(
                 stream_name,
             )
         )
-    except:
-        cur.execute(
-            """UPDATE rooms 
-            SET 
-            live_server_id = ?, 
-            webhook_url = ?,
-            owner_id = ?,
-            owner_name = ?,
-            stream_name = ?
-            WHERE room_id = ?
-            """,
-            (
-                live_server_id,
-                webhook,
-                owner_id,
-                owner_name,
-                stream_name,
-                room_id,
-            )
+        await conn.commit()
+    await _invalidate(room_id)
+
+
+async def delete_room(room_id: str):
+    conn = _get_conn()
+    async with _write_lock:
+        await conn.execute(
+            "DELETE FROM rooms WHERE room_id = ?",
+            (room_id,)
         )
-    cur.close()
-    conn.commit()
+        await conn.commit()
+    await _invalidate(room_id)
 
 
-def delete_room(room_id: str):
-    cur = conn.cursor()
-    cur.execute(
-        "DELETE FROM rooms WHERE room_id = ?",
-        (room_id,)
-    )
-    cur.close()
-    conn.commit()
+async def delete_rooms(room_ids: Iterable[str]):
+    """ Deletes many rooms in one transaction """
+    room_ids = list(dict.fromkeys(room_ids))
+    if not room_ids:
+        return
+
+    conn = _get_conn()
+    async with _write_lock:
+        try:
+            for chunk in _chunks(room_ids):
+                placeholders = ", ".join("?" * len(chunk))
+                await conn.execute(
+                    f"DELETE FROM rooms WHERE room_id IN ({placeholders})",
+                    chunk
+                )
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
 
+    for room_id in room_ids:
+        await _invalidate(room_id)
@@ -2,15 +2,26 @@ import typing as t
 
 from importlib import import_module
 
-from .endpoints import Blueprint
+from .endpoints import Blueprint, Endpoint
 
 __all__ = ["Router"]
 
 
 class Router:
-    def __init__(self, web_app: object, app_files: t.Union[t.List[str], t.Tuple[str]], import_callback: t.Callable):
+    def __init__(
+            self,
+            web_app: object,
+            app_files: t.Union[t.List[str], t.Tuple[str]],
+            import_callback: t.Callable,
+            wrap_callback: t.Optional[t.Callable[[str, t.Callable], t.Callable]] = None,
+    ):
+        """
+        `wrap_callback` is given the name and callback of every http
+        endpoint as it is registered and returns the callback to use instead.
+        """
         self._app = web_app
         self._import_callback = import_callback
+        self._wrap_callback = wrap_callback
 
         setattr(self._app, 'add_blueprint', self.add_blueprint)
 
@@ -36,5 +47,7 @@ class Router:
             callback = getattr(bp, ep.callback_name, None)
             if callback is None:
                 raise AttributeError("No endpoint called {} in blueprint {}", ep.callback_name, bp)
+            if self._wrap_callback is not None and isinstance(ep, Endpoint):
+                callback = self._wrap_callback(ep.name, callback)
             ep.callback = callback
             self._import_callback(self._app, ep)
@@ -1,21 +1,50 @@
 from utils.settings import load_settings
 
-SETTINGS = load_settings("./settings.json")
+SETTINGS_PATH = "./settings.json"
+SETTINGS = load_settings(SETTINGS_PATH)
+
+import os
+import asyncio
+import logging
+import orjson
 
 from fastapi import FastAPI
+from fastapi.exceptions import RequestValidationError
 from fastapi.staticfiles import StaticFiles
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+from typing import Optional
 
-from distribution import LiveServerManager, LiveServer
+from cache import TTLCache, create_backend, start_sweeper, stop_sweeper
+from distribution import LiveServerManager
 from sessions import SessionCollection
+from utils.assets import RemoteAssets
+from utils.http import HttpClient
+from utils.discord import DiscordClient
+from utils.metrics import Metrics
+from utils.pages import Page
+
+
+# Fleet changes made through the admin api are sent to every worker on this.
+LIVE_SERVER_CHANNEL = "live-servers:control"
 
+logger = logging.getLogger(__name__)
+
+BYTECODE_CACHE_DIR = "./.cache/jinja"
+os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
 
 templates = Environment(
     loader=FileSystemLoader("./templates"),
+    bytecode_cache=FileSystemBytecodeCache(BYTECODE_CACHE_DIR),
+    autoescape=select_autoescape(["html"]),
     enable_async=True,
 )
 
+# Templates whose output only depends on the context they are given, their
+# rendered pages are kept per distinct context by `render_page`.
+cacheable_templates = set()
+rendered_pages = TTLCache(max_size=SETTINGS.rendered_cache_size)
+
 
 async def render_template(template: str, *args, **kwargs):
     t = templates.get_template(template)
@@ -25,17 +54,42 @@ async def render_template(template: str, *args, **kwargs):
     return await t.render_async(*args, **kwargs)
 
 
-server = LiveServer(
-    'us-1',
-    'us1.spooderfy.com',
-    'us-live-1.spooderfy.com',
-)
-
-server2 = LiveServer(
-    'us-2',
-    'us2.spooderfy.com',
-    'us-live-2.spooderfy.com',
-)
+def mark_cacheable(*names: str):
+    """ Declares the given templates safe to cache the rendered output of """
+    cacheable_templates.update(names)
+
+
+async def render_page(template: str, **context) -> Page:
+    """
+    Renders a template to a Page, if the template was marked cacheable the
+    page is only rendered the first time a given context is seen and
+    returned straight from memory after that along with its ETag and
+    compressed body.
+    """
+    key = None
+    if template in cacheable_templates:
+        key = (template, tuple(sorted(context.items())))
+        try:
+            return rendered_pages.get(key)
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable context values, render it every time instead.
+            key = None
+
+    page = Page((await render_template(template, **context)).encode())
+    if key is not None:
+        rendered_pages.set(key, page)
+    return page
+
+
+def preload_templates():
+    """
+    Compiles every template up front, when running several workers this is
+    done once before forking so they all share the compiled templates.
+    """
+    for name in templates.list_templates():
+        templates.get_template(name)
 
 
 class Hades(FastAPI):
@@ -45,6 +99,43 @@ class Hades(FastAPI):
     ):
         super().__init__(**extra)
 
+        self.metrics = Metrics(
+            directory=SETTINGS.metrics_directory,
+            flush_interval=SETTINGS.metrics_flush_interval,
+        )
+        self.add_exception_handler(RequestValidationError, self.metrics.on_validation_error)
+        self.cache_backend = create_backend(SETTINGS.redis_url)
+        self.http = HttpClient(
+            limit=SETTINGS.http_pool_size,
+            limit_per_host=SETTINGS.http_pool_per_host,
+            timeout=SETTINGS.http_timeout,
+        )
+        self.discord = DiscordClient(
+            self.http,
+            base_url=SETTINGS.discord_api_url,
+            max_concurrency=SETTINGS.discord_concurrency,
+            timeout=SETTINGS.discord_timeout,
+            max_retries=SETTINGS.discord_max_retries,
+            max_retry_wait=SETTINGS.discord_max_retry_wait,
+        )
+        self.assets = RemoteAssets(
+            self.http,
+            interval=SETTINGS.asset_refresh_interval,
+        )
+
+        self.metrics.track("upstream", self.http.upstreams)
+
+        self.on_event("startup")(start_sweeper)
+        self.on_event("startup")(self.metrics.start)
+        self.on_event("startup")(self.cache_backend.connect)
+        self.on_event("startup")(self.http.start)
+        self.on_event("startup")(self.assets.start)
+        self.on_event("shutdown")(self.assets.close)
+        self.on_event("shutdown")(stop_sweeper)
+        self.on_event("shutdown")(self.cache_backend.close)
+        self.on_event("shutdown")(self.http.close)
+        self.on_event("shutdown")(self.metrics.close)
+
         if SETTINGS.serve_static:
             self.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -54,10 +145,97 @@ class Hades(FastAPI):
         self.spooderfy_domain = SETTINGS.spooderfy_domain
         self.gateway_domain = SETTINGS.gateway_domain
 
-        self.live_server = LiveServerManager(server)
-        self.live_server.add_server(server2)
+        self.live_server = LiveServerManager(
+            http=self.http,
+            authorization=SETTINGS.live_server_auth,
+            poll_interval=SETTINGS.live_server_poll_interval,
+        )
+        self.live_server.configure(
+            SETTINGS.live_servers,
+            SETTINGS.default_live_server,
+        )
+        self._settings_mtime = _mtime(SETTINGS_PATH)
+        self._settings_watcher: Optional[asyncio.Task] = None
+
+        self.on_event("startup")(self.live_server.start)
+        self.on_event("startup")(self._start_settings_watch)
+        self.on_event("shutdown")(self.live_server.close)
+        self.on_event("shutdown")(self._stop_settings_watch)
 
         self.gateway_url = SETTINGS.gateway_url
 
-        self.sessions = SessionCollection()
+        self.sessions = SessionCollection(backend=self.cache_backend)
         self.sessions.mount_middleware(self)
+
+    def reload_live_servers(self):
+        """
+        Re-reads the live server fleet from the settings file, the rest of
+        the settings still need a restart to change.
+        """
+        settings = load_settings(SETTINGS_PATH)
+        self.live_server.configure(
+            settings.live_servers,
+            settings.default_live_server,
+        )
+
+    async def broadcast_live_servers(self, message: dict):
+        """ Sends a fleet change to every worker, this one included """
+        await self.cache_backend.publish(
+            LIVE_SERVER_CHANNEL,
+            orjson.dumps(message),
+        )
+
+    def _on_live_server_message(self, raw: bytes):
+        message = orjson.loads(raw)
+        if message["action"] == "reload":
+            try:
+                self.reload_live_servers()
+            except (OSError, ValueError):
+                # Caught half way through being written, the fleet stays as
+                # it is until the next reload or the settings watcher runs.
+                logger.exception("could not reload the live servers from %s", SETTINGS_PATH)
+        elif message["action"] == "drain":
+            self.live_server.drain(message["id"], message["draining"])
+
+    async def _start_settings_watch(self):
+        await self.cache_backend.subscribe(
+            LIVE_SERVER_CHANNEL,
+            self._on_live_server_message,
+        )
+
+        if SETTINGS.settings_watch_interval > 0:
+            self._settings_watcher = asyncio.get_event_loop().create_task(
+                self._watch_settings(SETTINGS.settings_watch_interval)
+            )
+
+    async def _stop_settings_watch(self):
+        if self._settings_watcher is not None:
+            self._settings_watcher.cancel()
+            try:
+                await self._settings_watcher
+            except asyncio.CancelledError:
+                pass
+            self._settings_watcher = None
+
+    async def _watch_settings(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+
+            mtime = _mtime(SETTINGS_PATH)
+            if mtime == self._settings_mtime:
+                continue
+
+            try:
+                self.reload_live_servers()
+            except (OSError, ValueError):
+                # Most likely caught half way through being written, the
+                # mtime is left alone so it is tried again next time.
+                continue
+            self._settings_mtime = mtime
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
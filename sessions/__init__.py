@@ -1 +1,3 @@
 from .collection import SessionCollection
+from .session import Session
+from .store import SessionStore
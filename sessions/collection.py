@@ -1,36 +1,180 @@
+import orjson
+
+from http.cookies import SimpleCookie
+from typing import Any, Optional, Tuple
+
 from fastapi import Request, FastAPI, responses
-from itsdangerous import URLSafeSerializer
+from itsdangerous import BadSignature, URLSafeSerializer
 
+from cache import SharedBackend, TTLCache
 from server import SETTINGS
+from utils.generation import create_session_id
+from .session import Session
+from .store import SessionStore
+
+
+class _OrjsonSerializer:
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    @staticmethod
+    def loads(data: bytes):
+        return orjson.loads(data)
 
 
 class SessionCollection:
     """
     A collection of sessions that can implement and manage sessions of
     individual requests and link them back to the request.
+
+    By default the whole session is signed into the cookie, with
+    `server_sessions` enabled the cookie only holds a signed session id
+    and the data lives in a SessionStore on the shared cache backend.
     """
 
-    def __init__(self):
-        self._serializer = URLSafeSerializer(SETTINGS.secure_key, "ree")
+    def __init__(
+        self,
+        backend: Optional[SharedBackend] = None,
+        cache_size: int = 10_000,
+        cache_ttl: float = 300.0,
+    ):
+        self._serializer = URLSafeSerializer(
+            SETTINGS.secure_key,
+            "ree",
+            serializer=_OrjsonSerializer,
+        )
+
+        # Cookie value -> verified json payload (None if the signature was
+        # bad), repeat requests with the same cookie skip the HMAC check.
+        self._verified = TTLCache(cache_ttl, cache_size)
+
+        self.store: Optional[SessionStore] = None
+        if SETTINGS.server_sessions:
+            if SETTINGS.redis_url is None and SETTINGS.workers != 1:
+                raise RuntimeError(
+                    "server_sessions needs a redis_url to share sessions"
+                    " between workers."
+                )
+            if backend is None:
+                raise ValueError("server_sessions needs a cache backend")
+
+            self.store = SessionStore(backend, ttl=SETTINGS.session_ttl)
 
     def mount_middleware(self, app: FastAPI):
-        """ Mounts self to a given FastAPI app in the form of middleware """
-        app.middleware("http")(self.as_middleware)
+        """ Mounts self to a given FastAPI app in the form of ASGI middleware """
+        from .middleware import SessionMiddleware
+
+        if self.store is not None:
+            app.on_event("startup")(self.store.start)
+        app.add_middleware(SessionMiddleware, sessions=self)
+
+    def _verify(self, cookie: str) -> Optional[bytes]:
+        try:
+            return self._verified.get(cookie)
+        except KeyError:
+            pass
+
+        try:
+            payload = orjson.dumps(self._serializer.loads(cookie))
+        except BadSignature:
+            payload = None
+
+        self._verified.set(cookie, payload)
+        return payload
+
+    def _sign(self, data: Any) -> str:
+        cookie = self._serializer.dumps(data).decode()
+        self._verified.set(cookie, orjson.dumps(data))
+        return cookie
+
+    async def load(self, cookie: Optional[str]) -> Tuple[Session, Optional[str]]:
+        """ Returns the session for a cookie and its id in server mode """
+        if cookie is None:
+            return Session(), None
+
+        payload = self._verify(cookie)
+        if payload is None:
+            # Tampered or signed with an old key, drop the cookie.
+            sess = Session()
+            sess.modified = True
+            return sess, None
+
+        data = orjson.loads(payload)
+        if self.store is None:
+            return Session(data), None
+
+        sess = None
+        if isinstance(data, str):
+            sess = await self.store.load(data)
+
+        if sess is None:
+            # Expired, or a cookie from before server sessions were enabled.
+            sess = Session()
+            sess.modified = True
+            return sess, None
+        return sess, data
+
+    async def save(
+        self,
+        sess: Session,
+        session_id: Optional[str],
+        had_cookie: bool,
+    ) -> Optional[str]:
+        """
+        Saves a session if it was changed, returning the Set-Cookie header
+        value to send back or None if the cookie stays the same.
+        """
+        if not getattr(sess, "modified", True):
+            return None
+
+        if isinstance(sess, Session):
+            sess.modified = False
+
+        if not sess:
+            if session_id is not None:
+                await self.store.delete(session_id)
+            if had_cookie:
+                return _cookie_header("", max_age=0)
+            return None
+
+        if self.store is None:
+            return _cookie_header(self._sign(sess))
+
+        cookie = None
+        if session_id is None:
+            session_id = create_session_id()
+            cookie = _cookie_header(self._sign(session_id))
+
+        await self.store.save(session_id, sess)
+        return cookie
 
     async def as_middleware(self, request: Request, call_next):
-        maybe_session = request.cookies.get("session")
-        if maybe_session is not None:
-            sess = self._serializer.loads(maybe_session)
-        else:
-            sess = {}
+        """
+        The session handling as a `app.middleware("http")` function, this
+        goes through starlette's BaseHTTPMiddleware so SessionMiddleware is
+        what gets mounted, this is kept around to compare against.
+        """
+        had_cookie = "session" in request.cookies
+        sess, session_id = await self.load(request.cookies.get("session"))
 
         request.scope['session'] = sess
         resp: responses.Response = await call_next(request)
 
-        resp.set_cookie(
-            "session",
-            self._serializer.dumps(request.scope['session']),
-            secure=SETTINGS.secure_sessions,  # todo set to true
-        )
-
+        cookie = await self.save(request.scope['session'], session_id, had_cookie)
+        if cookie is not None:
+            resp.raw_headers.append((b"set-cookie", cookie.encode("latin-1")))
         return resp
+
+
+def _cookie_header(value: str, max_age: Optional[int] = None) -> str:
+    cookie = SimpleCookie()
+    cookie["session"] = value
+    morsel = cookie["session"]
+    morsel["path"] = "/"
+    morsel["samesite"] = "lax"
+    if max_age is not None:
+        morsel["max-age"] = max_age
+    if SETTINGS.secure_sessions:  # todo set to true
+        morsel["secure"] = True
+    return morsel.OutputString()
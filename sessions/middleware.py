@@ -0,0 +1,68 @@
+from typing import Optional
+
+from .collection import SessionCollection
+
+
+class SessionMiddleware:
+    """
+    Loads the session of every http and websocket connection into
+    `scope["session"]` as plain ASGI middleware.
+
+    Nothing is wrapped apart from `send`, which only looks at the message
+    that starts the response (or accepts the websocket) to add the
+    Set-Cookie header, body chunks are passed straight through so
+    streaming responses stay streamed.
+    """
+
+    def __init__(self, app, sessions: SessionCollection):
+        self.app = app
+        self.sessions = sessions
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            start_message = "http.response.start"
+        elif scope["type"] == "websocket":
+            start_message = "websocket.accept"
+        else:
+            return await self.app(scope, receive, send)
+
+        cookie = _session_cookie(scope)
+        sess, session_id = await self.sessions.load(cookie)
+        scope["session"] = sess
+
+        async def send_wrapper(message):
+            if message["type"] == start_message:
+                header = await self.sessions.save(
+                    scope["session"],
+                    session_id,
+                    cookie is not None,
+                )
+                if header is not None:
+                    headers = list(message.get("headers") or [])
+                    headers.append((b"set-cookie", header.encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+        # A websocket can keep changing its session after the handshake,
+        # server side sessions can still be saved once it closes.
+        sess = scope["session"]
+        if (
+            scope["type"] == "websocket"
+            and session_id is not None
+            and getattr(sess, "modified", False)
+        ):
+            await self.sessions.store.save(session_id, sess)
+
+
+def _session_cookie(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name != b"cookie":
+            continue
+
+        for chunk in value.decode("latin-1").split(";"):
+            key, sep, val = chunk.partition("=")
+            if sep and key.strip() == "session":
+                return val.strip().strip('"')
+    return None
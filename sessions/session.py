@@ -0,0 +1,81 @@
+from time import time
+
+
+ROOM_GRANTS_KEY = "rooms"
+
+# The most rooms a session remembers access to, the grants closest to
+# expiring are dropped first.
+MAX_ROOM_GRANTS = 32
+
+
+class Session(dict):
+    """
+    A session's data, a plain dict which remembers if it has been changed
+    since it was loaded so the cookie only has to be re-signed and sent
+    back when something actually changed.
+
+    Only changes to the session itself are seen, mutating a value stored
+    in it in place needs the key to be set again.
+    """
+
+    __slots__ = ("modified",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.modified = False
+
+    def __setitem__(self, key, value):
+        if not self.modified and (key not in self or self[key] != value):
+            self.modified = True
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.modified = True
+        super().__delitem__(key)
+
+    def clear(self):
+        self.modified = True
+        super().clear()
+
+    def pop(self, key, *default):
+        if key in self:
+            self.modified = True
+        return super().pop(key, *default)
+
+    def popitem(self):
+        self.modified = True
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.modified = True
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self.modified = True
+        super().update(*args, **kwargs)
+
+    def grant_room(self, room_id: str, ttl: float):
+        """
+        Gives the session access to a room for `ttl` seconds, grants are
+        kept as one room_id -> expiry mapping and only renewed once half
+        their time is up so revisiting a room doesn't rewrite the session.
+        """
+        now = time()
+        grants = self.get(ROOM_GRANTS_KEY) or {}
+
+        expires_at = grants.get(room_id)
+        if expires_at is not None and expires_at - now > ttl / 2:
+            return
+
+        grants = {rid: exp for rid, exp in grants.items() if exp > now}
+        grants[room_id] = int(now + ttl)
+        if len(grants) > MAX_ROOM_GRANTS:
+            kept = sorted(grants.items(), key=lambda item: item[1])[-MAX_ROOM_GRANTS:]
+            grants = dict(kept)
+
+        self[ROOM_GRANTS_KEY] = grants
+
+    def has_room(self, room_id: str) -> bool:
+        grants = self.get(ROOM_GRANTS_KEY)
+        return grants is not None and grants.get(room_id, 0) > time()
@@ -0,0 +1,48 @@
+from typing import Optional
+
+from cache import SharedBackend, TieredCache
+from .session import Session
+
+
+class SessionStore:
+    """
+    Server side session data keyed by session id, kept in a small LRU in
+    each worker in front of the shared cache backend so any worker can pick
+    up a session another worker wrote.
+
+    Sessions expire `ttl` seconds after they were last changed.
+    """
+
+    def __init__(
+        self,
+        backend: SharedBackend,
+        ttl: float,
+        near_ttl: float = 60.0,
+        max_size: int = 10_000,
+    ):
+        self._cache = TieredCache(
+            "sessions",
+            backend,
+            ttl=ttl,
+            near_ttl=min(near_ttl, ttl),
+            max_size=max_size,
+        )
+
+    @property
+    def stats(self) -> dict:
+        return self._cache.stats
+
+    async def start(self):
+        await self._cache.start()
+
+    async def load(self, session_id: str) -> Optional[Session]:
+        data = await self._cache.get(session_id)
+        if data is None:
+            return None
+        return Session(data)
+
+    async def save(self, session_id: str, sess: Session):
+        await self._cache.set(session_id, dict(sess))
+
+    async def delete(self, session_id: str):
+        await self._cache.delete(session_id)
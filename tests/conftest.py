@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The app's packages live at the top of the repository rather than in an
+# installed package, make them importable however pytest is started.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
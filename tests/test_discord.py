@@ -0,0 +1,169 @@
+import asyncio
+import pytest
+
+from time import monotonic
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from utils.http import HttpClient
+from utils.discord import DiscordClient, DiscordError
+
+
+def run(routes, test, **client_options):
+    """
+    Serves `routes` as a stub discord api and runs `test(client, hits)`
+    against it, `hits` lists the (path, time) of every request made.
+    """
+    hits = []
+
+    @web.middleware
+    async def record(request, handler):
+        hits.append((request.path, monotonic()))
+        return await handler(request)
+
+    async def main():
+        app = web.Application(middlewares=[record])
+        app.add_routes(routes)
+        server = TestServer(app)
+        await server.start_server()
+
+        http = HttpClient()
+        await http.start()
+        try:
+            client = DiscordClient(http, str(server.make_url("/api")), **client_options)
+            await test(client, hits)
+        finally:
+            await http.close()
+            await server.close()
+
+    asyncio.run(main())
+
+
+def test_route_429_is_retried_after_retry_after():
+    calls = 0
+
+    async def token(request):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            return web.json_response(
+                {"retry_after": 0.2, "global": False},
+                status=429,
+                headers={"X-RateLimit-Bucket": "token"},
+            )
+        return web.json_response({"access_token": "abc"})
+
+    async def test(client, hits):
+        data = await client.exchange_code("code", 1, "secret", "http://localhost/authorized")
+        assert data == {"access_token": "abc"}
+        assert len(hits) == 2
+        assert hits[1][1] - hits[0][1] >= 0.2
+        assert client.rate_limited == 1
+
+    run([web.post("/api/oauth2/token", token)], test)
+
+
+def test_global_429_holds_back_other_routes():
+    calls = 0
+
+    async def limited(request):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            return web.json_response(
+                {"retry_after": 0.3, "global": True},
+                status=429,
+                headers={"X-RateLimit-Global": "true"},
+            )
+        return web.json_response({})
+
+    async def other(request):
+        return web.json_response({})
+
+    async def test(client, hits):
+        first = asyncio.ensure_future(client.request("GET", "/limited"))
+        while not hits:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        await client.request("GET", "/other")
+        await first
+
+        times = {}
+        for path, at in hits:
+            times.setdefault(path, []).append(at)
+        started = times["/api/limited"][0]
+        assert times["/api/other"][0] - started >= 0.3
+        assert times["/api/limited"][1] - started >= 0.3
+
+    run([web.get("/api/limited", limited), web.get("/api/other", other)], test)
+
+
+def test_requests_queue_within_a_bucket():
+    limit, window = 2, 0.3
+    state = {"remaining": limit, "reset": 0.0, "refused": 0}
+
+    async def me(request):
+        now = monotonic()
+        if now >= state["reset"]:
+            state["remaining"], state["reset"] = limit, now + window
+        if state["remaining"] == 0:
+            state["refused"] += 1
+            return web.json_response({"retry_after": state["reset"] - now}, status=429)
+
+        state["remaining"] -= 1
+        return web.json_response({"id": "1"}, headers={
+            "X-RateLimit-Bucket": "me",
+            "X-RateLimit-Remaining": str(state["remaining"]),
+            "X-RateLimit-Reset-After": str(state["reset"] - now),
+        })
+
+    async def test(client, hits):
+        start = monotonic()
+        users = await asyncio.gather(*(client.get_current_user("token") for _ in range(6)))
+        assert users == [{"id": "1"}] * 6
+        # Waiting for the bucket to reset rather than hitting discord.
+        assert state["refused"] == 0
+        assert len(hits) == 6
+        assert monotonic() - start >= 2 * window
+
+    run([web.get("/api/users/@me", me)], test)
+
+
+def test_users_have_their_own_buckets():
+    async def me(request):
+        return web.json_response({"id": "1"}, headers={
+            "X-RateLimit-Bucket": "me",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset-After": "5",
+        })
+
+    async def test(client, hits):
+        await client.get_current_user("first")
+        await asyncio.wait_for(client.get_current_user("second"), 1)
+
+    run([web.get("/api/users/@me", me)], test)
+
+
+def test_slow_requests_time_out():
+    async def slow(request):
+        await asyncio.sleep(2)
+        return web.json_response({})
+
+    async def test(client, hits):
+        with pytest.raises(asyncio.TimeoutError):
+            await client.request("GET", "/slow")
+
+    run([web.get("/api/slow", slow)], test, timeout=0.2)
+
+
+def test_error_responses_raise():
+    async def token(request):
+        return web.json_response({"error": "invalid_grant"}, status=400)
+
+    async def test(client, hits):
+        with pytest.raises(DiscordError) as e:
+            await client.exchange_code("code", 1, "secret", "http://localhost/authorized")
+        assert e.value.status == 400
+        assert len(hits) == 1
+
+    run([web.post("/api/oauth2/token", token)], test)
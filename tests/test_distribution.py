@@ -0,0 +1,125 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from distribution import LiveServerManager
+from utils.http import HttpClient
+from utils.settings import LiveServerSettings
+
+
+class StubControl:
+    """ A live server's control endpoint that can be told to fail """
+
+    def __init__(self, capacity: int = 10):
+        self.capacity = capacity
+        self.failing = False
+        self.body = None
+        self.polls = 0
+
+        app = web.Application()
+        app.router.add_get("/control/stats", self.stats)
+        self.server = TestServer(app)
+
+    async def stats(self, request):
+        self.polls += 1
+        assert request.query["authorization"] == "secret"
+        if self.failing:
+            return web.json_response({}, status=500)
+        if self.body is not None:
+            return web.Response(text=self.body, content_type="application/json")
+        return web.json_response({"capacity": self.capacity})
+
+    def settings(self, server_id: str) -> LiveServerSettings:
+        return LiveServerSettings(
+            id=server_id,
+            rtmp_domain=f"{server_id}.example.com",
+            control_domain=f"{self.server.host}:{self.server.port}",
+            control_scheme="http",
+        )
+
+
+def run(test, count: int = 2):
+    async def main():
+        stubs = [StubControl() for _ in range(count)]
+        for stub in stubs:
+            await stub.server.start_server()
+
+        http = HttpClient()
+        await http.start()
+        manager = LiveServerManager(http=http, authorization="secret", max_failures=2)
+        manager.configure(
+            [stub.settings(f"us-{i + 1}") for i, stub in enumerate(stubs)],
+            "us-1",
+        )
+        try:
+            await test(manager, stubs)
+        finally:
+            await manager.close()
+            await http.close()
+            for stub in stubs:
+                await stub.server.close()
+
+    asyncio.run(main())
+
+
+def test_polling_reads_capacity():
+    async def test(manager, stubs):
+        stubs[0].capacity = 3
+        stubs[1].capacity = 7
+        await manager.poll_all()
+
+        assert [stub.polls for stub in stubs] == [1, 1]
+        assert manager.get("us-1").capacity == 3
+        assert manager.get("us-2").capacity == 7
+        assert all(server.healthy for server in manager.servers)
+
+    run(test)
+
+
+def test_unhealthy_servers_leave_rotation_until_they_recover():
+    async def test(manager, stubs):
+        stubs[0].failing = True
+
+        await manager.poll_all()
+        assert manager.get("us-1").healthy
+
+        await manager.poll_all()
+        assert not manager.get("us-1").healthy
+        assert {manager.place().id for _ in range(4)} == {"us-2"}
+
+        stubs[0].failing = False
+        await manager.poll_all()
+        assert manager.get("us-1").healthy
+        assert manager.place().id == "us-1"
+
+    run(test)
+
+
+def test_rooms_go_to_the_least_loaded_server():
+    async def test(manager, stubs):
+        stubs[0].capacity = 10
+        stubs[1].capacity = 30
+        await manager.poll_all()
+
+        placed = [manager.place().id for _ in range(8)]
+        assert placed.count("us-1") == 2
+        assert placed.count("us-2") == 6
+
+        manager.release("us-2")
+        manager.release("us-2")
+        assert manager.get("us-2").rooms == 4
+
+    run(test)
+
+
+def test_bad_stats_bodies_count_as_failed_polls():
+    async def test(manager, stubs):
+        stubs[0].body = "null"
+        stubs[1].body = "[1, 2]"
+
+        await manager.poll_all()
+        await manager.poll_all()
+        assert not any(server.healthy for server in manager.servers)
+
+    run(test)
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from rooms.emit import EmitPipeline
+from utils.http import HttpClient
+
+
+class StubGateway:
+    """ The gateway's emit routes, with or without the batch route """
+
+    def __init__(self, batch_route: bool = True):
+        self.events = []
+        self.posts = 0
+        self.failing = False
+
+        app = web.Application()
+        app.router.add_post("/emit/{room_id}", self.emit)
+        if batch_route:
+            app.router.add_post("/emit/{room_id}/batch", self.emit_batch)
+        self.server = TestServer(app)
+
+    async def emit(self, request):
+        self.posts += 1
+        if self.failing:
+            return web.json_response({}, status=500)
+        self.events.append(await request.json())
+        return web.json_response({})
+
+    async def emit_batch(self, request):
+        self.posts += 1
+        if self.failing:
+            return web.json_response({}, status=500)
+        self.events.extend(await request.json())
+        return web.json_response({})
+
+
+def run(test, batch_route: bool = True, **kwargs):
+    async def main():
+        gateway = StubGateway(batch_route)
+        await gateway.server.start_server()
+
+        http = HttpClient()
+        await http.start()
+        pipeline = EmitPipeline(http, str(gateway.server.make_url("/emit")), **kwargs)
+        try:
+            await test(pipeline, gateway)
+        finally:
+            await pipeline.close()
+            await http.close()
+            await gateway.server.close()
+
+    asyncio.run(main())
+
+
+async def drain(pipeline: EmitPipeline):
+    while pipeline.stats["queued"] or pipeline.sent + pipeline.lost < pipeline.submitted:
+        await asyncio.sleep(0.01)
+
+
+def test_waiting_events_are_sent_as_one_batch():
+    async def test(pipeline, gateway):
+        for i in range(10):
+            assert pipeline.submit("room", i)
+        await drain(pipeline)
+
+        assert gateway.events == list(range(10))
+        assert gateway.posts < 10
+        assert pipeline.stats["batching"]
+
+    run(test, max_batch=64)
+
+
+def test_batches_fall_back_to_single_posts_without_a_batch_route():
+    async def test(pipeline, gateway):
+        for i in range(10):
+            pipeline.submit("room", i)
+        await drain(pipeline)
+
+        assert gateway.events == list(range(10))
+        assert pipeline.sent == 10
+        assert pipeline.lost == 0
+        assert not pipeline.stats["batching"]
+
+    run(test, batch_route=False, max_batch=64)
+
+
+def test_losses_are_logged_as_one_summary(caplog):
+    async def test(pipeline, gateway):
+        gateway.failing = True
+        with caplog.at_level(logging.WARNING, logger="rooms.emit"):
+            for i in range(5):
+                pipeline.submit("room", i)
+            await drain(pipeline)
+
+        assert pipeline.lost == 5
+        assert len(caplog.records) == 1
+
+    run(test, max_batch=1)
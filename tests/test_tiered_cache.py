@@ -0,0 +1,64 @@
+import asyncio
+
+from cache import MemoryBackend, TieredCache
+
+
+async def workers(count: int = 2):
+    """ Tiered caches sharing one in-memory backend, as separate workers would """
+    backend = MemoryBackend()
+    caches = [TieredCache("rooms", backend, ttl=60) for _ in range(count)]
+    for cache in caches:
+        await cache.start()
+    return caches
+
+
+async def delivered():
+    # MemoryBackend hands messages to subscribers on the next loop iteration.
+    await asyncio.sleep(0)
+
+
+def test_set_evicts_other_near_caches():
+    async def main():
+        first, second = await workers()
+
+        await first.set("abc", {"owner": 1})
+        assert await second.get("abc") == {"owner": 1}
+        assert "abc" in second._near
+
+        await first.set("abc", {"owner": 2})
+        await delivered()
+
+        assert "abc" not in second._near
+        assert await second.get("abc") == {"owner": 2}
+
+    asyncio.run(main())
+
+
+def test_delete_evicts_other_near_caches():
+    async def main():
+        first, second = await workers()
+
+        await first.set("abc", 1)
+        assert await second.get("abc") == 1
+
+        await first.delete("abc")
+        await delivered()
+
+        assert await second.get("abc") is None
+        assert second.shared_misses == 1
+
+    asyncio.run(main())
+
+
+def test_own_invalidations_keep_the_near_cache():
+    async def main():
+        first, second = await workers()
+
+        await first.set("abc", 1)
+        await delivered()
+
+        assert "abc" in first._near
+        assert await first.get("abc") == 1
+        assert first.shared_hits == 0
+
+    asyncio.run(main())
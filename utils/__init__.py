@@ -1,3 +1,7 @@
 from .generation import create_session_id, create_room_id
 from .auth import login_required, enforce_authorization
 from .settings import load_settings
+from .http import HttpClient
+from .metrics import Metrics
+from .discord import DiscordClient, DiscordError
+from .websockets import Connection
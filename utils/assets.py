@@ -0,0 +1,135 @@
+import os
+import asyncio
+import logging
+import aiofiles
+import orjson
+
+from typing import Dict, Optional
+
+from .http import HttpClient, STATIC
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteAsset:
+    __slots__ = ("name", "url", "body", "etag", "last_modified")
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.body: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+
+
+class RemoteAssets:
+    """
+    Files fetched from a remote server and served from memory.
+
+    On startup the last downloaded copy of every asset is loaded from
+    `cache_dir`, the remote copies are then revalidated in the background
+    with If-None-Match / If-Modified-Since every `interval` seconds so
+    starting up never waits on the network.
+    """
+
+    def __init__(self, http: HttpClient, cache_dir: str = "./.cache/assets", interval: float = 300.0):
+        self._http = http
+        self._cache_dir = cache_dir
+        self._interval = interval
+        self._assets: Dict[str, RemoteAsset] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, url: str):
+        self._assets[name] = RemoteAsset(name, url)
+
+    def get(self, name: str) -> Optional[bytes]:
+        """ The asset's content or None if it has never been downloaded """
+        return self._assets[name].body
+
+    async def start(self):
+        os.makedirs(self._cache_dir, exist_ok=True)
+        for asset in self._assets.values():
+            await self._load(asset)
+
+        self._task = asyncio.get_event_loop().create_task(self._revalidate_forever())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _path(self, asset: RemoteAsset) -> str:
+        return os.path.join(self._cache_dir, asset.name)
+
+    async def _load(self, asset: RemoteAsset):
+        path = self._path(asset)
+        try:
+            async with aiofiles.open(path + ".meta", "rb") as file:
+                meta = orjson.loads(await file.read())
+            async with aiofiles.open(path, "rb") as file:
+                body = await file.read()
+        except (OSError, ValueError):
+            return
+
+        # The cached copy belongs to an old url, download it again.
+        if meta.get("url") != asset.url:
+            return
+
+        asset.body = body
+        asset.etag = meta.get("etag")
+        asset.last_modified = meta.get("last_modified")
+
+    async def _store(self, asset: RemoteAsset):
+        path = self._path(asset)
+        meta = {
+            "url": asset.url,
+            "etag": asset.etag,
+            "last_modified": asset.last_modified,
+        }
+
+        # Written to a temporary file first so other workers revalidating
+        # the same asset never read a half written copy.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        async with aiofiles.open(tmp, "wb") as file:
+            await file.write(asset.body)
+        os.replace(tmp, path)
+
+        async with aiofiles.open(tmp, "wb") as file:
+            await file.write(orjson.dumps(meta))
+        os.replace(tmp, path + ".meta")
+
+    async def revalidate(self, asset: RemoteAsset) -> bool:
+        """ Fetches the asset if it changed, returning True if it did """
+        headers = {}
+        if asset.body is not None:
+            if asset.etag is not None:
+                headers["If-None-Match"] = asset.etag
+            if asset.last_modified is not None:
+                headers["If-Modified-Since"] = asset.last_modified
+
+        async with self._http.get(STATIC, asset.url, headers=headers) as resp:
+            if resp.status == 304:
+                return False
+
+            resp.raise_for_status()
+            body = await resp.read()
+            asset.etag = resp.headers.get("ETag")
+            asset.last_modified = resp.headers.get("Last-Modified")
+
+        asset.body = body
+        await self._store(asset)
+        return True
+
+    async def _revalidate_forever(self):
+        while True:
+            for asset in list(self._assets.values()):
+                try:
+                    await self.revalidate(asset)
+                except Exception:
+                    # Keep serving the copy we have until the next attempt.
+                    logger.exception("revalidating asset %s failed, serving the cached copy", asset.name)
+            await asyncio.sleep(self._interval)
@@ -0,0 +1,210 @@
+import asyncio
+import aiohttp
+
+from contextlib import asynccontextmanager
+from hashlib import blake2b
+from time import monotonic
+from typing import Any, AsyncIterator, Dict, Optional
+
+from cache import TTLCache
+from .http import HttpClient, DISCORD
+
+
+class DiscordError(Exception):
+    def __init__(self, status: int, data: Any):
+        super().__init__(f"discord responded with {status}: {data!r}")
+        self.status = status
+        self.data = data
+
+
+class RateLimited(DiscordError):
+    """ Discord kept rate limiting the request or wanted us to wait too long """
+
+
+class Bucket:
+    """
+    What we know of one discord rate limit bucket, requests on a bucket
+    with nothing remaining wait on `lock` in order until it resets.
+    """
+
+    __slots__ = ("lock", "remaining", "reset_at")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+
+    def update(self, headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            self.remaining = int(remaining)
+        if reset_after is not None:
+            self.reset_at = monotonic() + float(reset_after)
+
+
+class DiscordClient:
+    """
+    Makes requests to the discord api while keeping to its rate limits.
+
+    Every route (method and path) is tracked as a bucket, once discord tells
+    us which bucket hash a route belongs to routes sharing a hash share the
+    bucket. Requests on a used up bucket wait for it to reset instead of
+    being sent, a 429 is waited out for as long as discord's retry-after
+    asks (up to `max_retry_wait`) and retried, a global 429 holds back every
+    request. At most `max_concurrency` requests are in flight at once.
+
+    Limits on requests made with a user's bearer token are per user, these
+    take the token as `major` so every user gets their own buckets.
+    """
+
+    def __init__(
+        self,
+        http: HttpClient,
+        base_url: str = "https://discord.com/api",
+        max_concurrency: int = 10,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+        max_retry_wait: float = 10.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+
+        self._http = http
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._max_retry_wait = max_retry_wait
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        self._route_hashes: Dict[str, str] = {}
+        # Buckets of users who logged in once don't need to stay around.
+        self._buckets = TTLCache(ttl=300, max_size=10000)
+        self._global_until = 0.0
+
+        self.rate_limited = 0
+
+    def _bucket(self, route: str, major: Optional[str]) -> Bucket:
+        key = f"{self._route_hashes.get(route, route)}:{major or ''}"
+        try:
+            return self._buckets.get(key)
+        except KeyError:
+            bucket = Bucket()
+            self._buckets.set(key, bucket)
+            return bucket
+
+    def _share(self, route: str, major: Optional[str], bucket: Bucket):
+        """
+        Files a bucket under the hash discord just gave its route, unless
+        another route with that hash already made one.
+        """
+        key = f"{self._route_hashes[route]}:{major or ''}"
+        if key not in self._buckets:
+            self._buckets.set(key, bucket)
+
+    @asynccontextmanager
+    async def _turn(self, bucket: Bucket) -> AsyncIterator[None]:
+        """
+        Waits until a request may be made on the bucket. While nothing is
+        known to remain, before the first response or after a reset, the
+        lock is held through the request so only that one goes out and the
+        ones queued behind it see the limits it brings back.
+        """
+        await bucket.lock.acquire()
+        held = True
+        try:
+            delay = max(self._global_until, bucket.reset_at if bucket.remaining == 0 else 0) - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                if monotonic() >= bucket.reset_at:
+                    bucket.remaining = None
+
+            if bucket.remaining:
+                bucket.remaining -= 1
+                bucket.lock.release()
+                held = False
+            yield
+        finally:
+            if held:
+                bucket.lock.release()
+
+    async def request(self, method: str, path: str, major: Optional[str] = None, **kwargs) -> Any:
+        """
+        Makes a request and returns its json, raises DiscordError for any
+        error response and RateLimited when the request couldn't be made
+        within the rate limits.
+        """
+        route = f"{method} {path}"
+        if major is not None:
+            # Tokens are only needed to tell users apart, don't keep them.
+            major = blake2b(major.encode(), digest_size=16).hexdigest()
+
+        for _ in range(self._max_retries + 1):
+            bucket = self._bucket(route, major)
+            async with self._turn(bucket), self._semaphore, self._http.request(
+                DISCORD,
+                method,
+                self.base_url + path,
+                timeout=self._timeout,
+                **kwargs,
+            ) as resp:
+                bucket.update(resp.headers)
+                bucket_hash = resp.headers.get("X-RateLimit-Bucket")
+                if bucket_hash is not None and self._route_hashes.get(route) != bucket_hash:
+                    self._route_hashes[route] = bucket_hash
+                    self._share(route, major, bucket)
+
+                try:
+                    data = await resp.json(content_type=None)
+                except (aiohttp.ContentTypeError, ValueError):
+                    data = None
+
+                if resp.status != 429:
+                    if resp.status >= 400:
+                        raise DiscordError(resp.status, data)
+                    return data
+
+                retry_after = _retry_after(resp.headers, data)
+                is_global = resp.headers.get("X-RateLimit-Global") is not None \
+                    or (isinstance(data, dict) and data.get("global", False))
+
+                # Set before the turn ends so requests queued on the bucket wait too.
+                if not is_global:
+                    bucket.remaining = 0
+                    bucket.reset_at = max(bucket.reset_at, monotonic() + retry_after)
+                elif retry_after <= self._max_retry_wait:
+                    self._global_until = max(self._global_until, monotonic() + retry_after)
+
+            self.rate_limited += 1
+            if retry_after > self._max_retry_wait:
+                raise RateLimited(429, data)
+
+        raise RateLimited(429, data)
+
+    async def exchange_code(self, code: str, client_id: int, client_secret: str, redirect_uri: str) -> dict:
+        """ Swaps an oauth2 code for the user's access token """
+        return await self.request(
+            "POST",
+            "/oauth2/token",
+            data={
+                'client_id': int(client_id),
+                'client_secret': client_secret,
+                'grant_type': 'authorization_code',
+                'code': code,
+                'redirect_uri': redirect_uri,
+                'scope': 'identify',
+            },
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+        )
+
+    async def get_current_user(self, token: str) -> dict:
+        return await self.request(
+            "GET",
+            "/users/@me",
+            major=token,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+
+def _retry_after(headers, data: Any) -> float:
+    if isinstance(data, dict) and "retry_after" in data:
+        return float(data["retry_after"])
+    return float(headers.get("Retry-After", 1))
@@ -1,6 +1,6 @@
 from uuid import uuid4
 from string import ascii_uppercase, digits
-from random import choices
+from secrets import choice
 
 
 SELECTION_LETTERS = [*ascii_uppercase, *digits]
@@ -12,6 +12,9 @@ def create_session_id() -> str:
 
 
 def create_room_id(k=5) -> str:
-    """ Creates a random string where k is the length of the id """
-    return "".join(choices(SELECTION_LETTERS, k=k))
+    """
+    Creates a random string where k is the length of the id, this does not
+    check the id is free, use rooms.RoomIdAllocator to hand out room ids.
+    """
+    return "".join(choice(SELECTION_LETTERS) for _ in range(k))
 
@@ -0,0 +1,142 @@
+import asyncio
+import aiohttp
+
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import AsyncIterator, Dict, Optional
+
+from .metrics import Histogram
+
+
+GATEWAY = "gateway"
+LIVE_SERVER = "live_server"
+DISCORD = "discord"
+STATIC = "static"
+
+
+class UpstreamStats:
+    __slots__ = ("requests", "errors", "timeouts", "total_time", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.latency = Histogram()
+
+    def record(self, elapsed: float):
+        self.requests += 1
+        self.total_time += elapsed
+        self.latency.observe(elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "total_time": self.total_time,
+        }
+
+
+class HttpClient:
+    """
+    The one aiohttp session shared by every blueprint.
+
+    Connections are pooled with a per-host limit and kept alive between
+    requests, DNS lookups are cached and every request has a timeout. Each
+    request is made against a named upstream (gateway, live server, discord)
+    which keeps its own request, error, timeout and time counters.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        timeout: float = 10.0,
+    ):
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_cache_ttl = dns_cache_ttl
+        self._timeout = timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._upstreams: Dict[str, UpstreamStats] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise RuntimeError("http client has not been started")
+        return self._session
+
+    @property
+    def upstreams(self) -> Dict[str, UpstreamStats]:
+        return self._upstreams
+
+    @property
+    def stats(self) -> Dict[str, dict]:
+        return {name: stats.as_dict() for name, stats in self._upstreams.items()}
+
+    def upstream_stats(self, upstream: str) -> UpstreamStats:
+        stats = self._upstreams.get(upstream)
+        if stats is None:
+            stats = self._upstreams[upstream] = UpstreamStats()
+        return stats
+
+    async def start(self):
+        if self._session is not None:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self._limit,
+            limit_per_host=self._limit_per_host,
+            keepalive_timeout=self._keepalive_timeout,
+            ttl_dns_cache=self._dns_cache_ttl,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @asynccontextmanager
+    async def request(
+        self,
+        upstream: str,
+        method: str,
+        url: str,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Makes a request to `upstream`, `timeout` overrides the default total
+        timeout for this call only.
+        """
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        stats = self.upstream_stats(upstream)
+        start = perf_counter()
+        try:
+            async with self.session.request(method, url, **kwargs) as resp:
+                yield resp
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise
+        except aiohttp.ClientError:
+            stats.errors += 1
+            raise
+        finally:
+            stats.record(perf_counter() - start)
+
+    def get(self, upstream: str, url: str, **kwargs):
+        return self.request(upstream, "GET", url, **kwargs)
+
+    def post(self, upstream: str, url: str, **kwargs):
+        return self.request(upstream, "POST", url, **kwargs)
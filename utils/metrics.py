@@ -0,0 +1,339 @@
+import os
+import asyncio
+import orjson
+
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
+
+
+# Upper bounds in seconds, anything slower lands in +Inf.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Counts of observed values per bucket, each value goes into exactly one
+    bucket and the counts are only made cumulative when rendered.
+    """
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def merge(self, counts: List[int], total: float):
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.sum += total
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """ (le, count) pairs the way prometheus expects them """
+        total = 0
+        pairs = []
+        for bound, count in zip((*map(repr, self.bounds), "+Inf"), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class EndpointStats:
+    __slots__ = ("statuses", "latency")
+
+    def __init__(self):
+        self.statuses: Dict[int, int] = {}
+        self.latency = Histogram()
+
+    def count(self, status: int):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def record(self, status: int, elapsed: float):
+        self.count(status)
+        self.latency.observe(elapsed)
+
+
+# Metric name prefix, label and help text of each group of call timings
+# given to `Metrics.track`.
+CALL_GROUPS = {
+    "upstream": ("spooderfy_upstream", "upstream", "Requests made to an upstream"),
+    "room_step": ("spooderfy_room_step", "step", "Upstream calls made to create or delete a room"),
+}
+
+
+class Metrics:
+    """
+    Request counts, status codes and latencies of every endpoint, along
+    with the timings of outgoing calls given to `track`.
+
+    Every worker counts into its own plain counters, they are only ever
+    touched from the worker's event loop so nothing needs a lock. Every
+    `flush_interval` seconds, on shutdown and before answering a scrape a
+    worker writes a snapshot of them to `<directory>/<pid>.json`, rendering
+    sums the snapshots of every worker so a scrape sees the whole server
+    whichever worker answers it. The snapshots of workers that have exited are kept so totals never
+    go backwards, `clear` removes them all when the server starts.
+    """
+
+    def __init__(self, directory: str = "./.cache/metrics", flush_interval: float = 5.0):
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self._by_callback: Dict[Callable, EndpointStats] = {}
+        self._groups: Dict[str, Dict[str, Any]] = {}
+
+        self._directory = directory
+        self._flush_interval = flush_interval
+        self._task: Optional[asyncio.Task] = None
+        # One flush at a time so an older snapshot never replaces a newer one.
+        self._flush_lock = asyncio.Lock()
+
+    def track(self, group: str, stats: Dict[str, Any]):
+        """
+        Includes a live dict of UpstreamStats by name, `group` is one of
+        CALL_GROUPS.
+        """
+        self._groups[group] = stats
+
+    def instrument(self, name: str, callback: Callable) -> Callable:
+        """
+        Wraps an endpoint's callback to time it, the signature is kept so
+        fastapi still sees the callback's own parameters.
+        """
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints[name] = EndpointStats()
+
+        @wraps(callback)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            status = 500
+            try:
+                resp = await callback(*args, **kwargs)
+                status = getattr(resp, "status_code", 200)
+                return resp
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            finally:
+                stats.record(status, perf_counter() - start)
+
+        self._by_callback[wrapper] = stats
+        return wrapper
+
+    async def on_validation_error(self, request: Request, exc: RequestValidationError):
+        """
+        Requests fastapi refuses never reach the wrapped callback, they are
+        counted here instead but not timed.
+        """
+        stats = self._by_callback.get(request.scope.get("endpoint"))
+        if stats is not None:
+            stats.count(422)
+        return await request_validation_exception_handler(request, exc)
+
+    def snapshot(self) -> dict:
+        return {
+            "endpoints": {
+                name: {
+                    "statuses": stats.statuses,
+                    "counts": stats.latency.counts,
+                    "sum": stats.latency.sum,
+                }
+                for name, stats in self.endpoints.items()
+            },
+            "calls": {
+                group: {
+                    name: {
+                        "requests": stats.requests,
+                        "errors": stats.errors,
+                        "timeouts": stats.timeouts,
+                        "counts": stats.latency.counts,
+                        "sum": stats.latency.sum,
+                    }
+                    for name, stats in calls.items()
+                }
+                for group, calls in self._groups.items()
+            },
+        }
+
+    def _path(self) -> str:
+        return os.path.join(self._directory, f"{os.getpid()}.json")
+
+    def _write(self, snapshot: dict):
+        """ Written next to its path first so readers never see half a snapshot """
+        os.makedirs(self._directory, exist_ok=True)
+        path = self._path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(orjson.dumps(snapshot, option=orjson.OPT_NON_STR_KEYS))
+        os.replace(tmp, path)
+
+    async def flush(self):
+        """ Writes this worker's snapshot, the file is written off the event loop """
+        async with self._flush_lock:
+            snapshot = self.snapshot()
+            await asyncio.get_event_loop().run_in_executor(None, self._write, snapshot)
+
+    def clear(self):
+        """ Removes every worker's snapshot, for when the server starts """
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            return
+
+        for name in names:
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except FileNotFoundError:
+                pass
+
+    def _read_snapshots(self) -> List[dict]:
+        snapshots = []
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            return snapshots
+
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self._directory, name), "rb") as file:
+                    snapshots.append(orjson.loads(file.read()))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    async def render(self) -> str:
+        """
+        Every metric of every worker summed, in the prometheus text format.
+
+        Only the flushed snapshots are summed, this worker's included once
+        it has written its own, mixing in live numbers would make a worker's
+        share go back to its older snapshot whenever another worker answers
+        the next scrape and look like a counter reset.
+        """
+        try:
+            await self.flush()
+        except OSError:
+            pass
+        snapshots = await asyncio.get_event_loop().run_in_executor(None, self._read_snapshots)
+
+        statuses: Dict[str, Dict[int, int]] = {}
+        latencies: Dict[str, Histogram] = {}
+        calls: Dict[str, Dict[str, dict]] = {group: {} for group in CALL_GROUPS}
+        for snapshot in snapshots:
+            for name, data in snapshot["endpoints"].items():
+                merged = statuses.setdefault(name, {})
+                for status, count in data["statuses"].items():
+                    merged[int(status)] = merged.get(int(status), 0) + count
+                latencies.setdefault(name, Histogram()).merge(data["counts"], data["sum"])
+
+            for group, named in snapshot["calls"].items():
+                if group not in calls:
+                    continue
+                for name, data in named.items():
+                    merged = calls[group].setdefault(name, {
+                        "requests": 0, "errors": 0, "timeouts": 0, "latency": Histogram(),
+                    })
+                    for key in ("requests", "errors", "timeouts"):
+                        merged[key] += data[key]
+                    merged["latency"].merge(data["counts"], data["sum"])
+
+        lines = [
+            "# HELP spooderfy_requests_total Requests handled by an endpoint by status code.",
+            "# TYPE spooderfy_requests_total counter",
+        ]
+        for name, counts in statuses.items():
+            for status, count in sorted(counts.items()):
+                lines.append(f"spooderfy_requests_total{{{_labels(endpoint=name, status=status)}}} {count}")
+
+        lines += [
+            "# HELP spooderfy_request_duration_seconds Time spent handling requests by endpoint, "
+            "requests refused for failing validation are not timed.",
+            "# TYPE spooderfy_request_duration_seconds histogram",
+        ]
+        for name, histogram in latencies.items():
+            _histogram(lines, "spooderfy_request_duration_seconds", histogram, endpoint=name)
+
+        for group, (prefix, label, description) in CALL_GROUPS.items():
+            named = calls[group]
+            for suffix, key, help_text in (
+                ("requests_total", "requests", f"{description}."),
+                ("errors_total", "errors", f"{description} that failed, with an error response or none at all."),
+                ("timeouts_total", "timeouts", f"{description} that timed out."),
+            ):
+                lines += [f"# HELP {prefix}_{suffix} {help_text}", f"# TYPE {prefix}_{suffix} counter"]
+                for name, data in named.items():
+                    lines.append(f"{prefix}_{suffix}{{{_labels(**{label: name})}}} {data[key]}")
+
+            lines += [
+                f"# HELP {prefix}_duration_seconds Time taken by {description[0].lower()}{description[1:]}.",
+                f"# TYPE {prefix}_duration_seconds histogram",
+            ]
+            for name, data in named.items():
+                _histogram(lines, f"{prefix}_duration_seconds", data["latency"], **{label: name})
+
+        lines += [
+            "# HELP spooderfy_workers Workers whose numbers are included.",
+            "# TYPE spooderfy_workers gauge",
+            f"spooderfy_workers {len(snapshots)}",
+            "",
+        ]
+        return "\n".join(lines)
+
+    async def start(self):
+        if self._flush_interval > 0 and self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._flush_forever())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush()
+        except OSError:
+            pass
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except OSError:
+                # Out of disk or the directory went away, the next flush
+                # writes the whole snapshot again anyway.
+                pass
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items())
+
+
+def _histogram(lines: List[str], metric: str, histogram: Histogram, **labels):
+    base = _labels(**labels)
+    for bound, count in histogram.cumulative():
+        lines.append(f'{metric}_bucket{{{base},le="{bound}"}} {count}')
+    lines.append(f"{metric}_sum{{{base}}} {histogram.sum}")
+    lines.append(f"{metric}_count{{{base}}} {histogram.count}")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,113 @@
+import gzip
+import orjson
+
+from hashlib import blake2b
+from typing import Any, Optional
+
+from fastapi import Request, responses
+
+
+# Bodies smaller than this cost more to compress than they save.
+GZIP_MIN_SIZE = 1024
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript")
+
+
+class Page:
+    """
+    A response body along with its strong ETag and gzipped copy, both are
+    only worked out the first time they are needed so a cached page pays
+    for hashing and compressing once.
+    """
+
+    __slots__ = ("body", "media_type", "_etag", "_gzipped")
+
+    def __init__(self, body: bytes, media_type: str = "text/html"):
+        self.body = body
+        self.media_type = media_type
+        self._etag: Optional[str] = None
+        self._gzipped: Optional[bytes] = None
+
+    @property
+    def etag(self) -> str:
+        if self._etag is None:
+            self._etag = f'"{blake2b(self.body, digest_size=16).hexdigest()}"'
+        return self._etag
+
+    @property
+    def gzip_etag(self) -> str:
+        # The compressed body is a different representation so it needs
+        # its own strong validator.
+        return self.etag[:-1] + '-gz"'
+
+    @property
+    def compressible(self) -> bool:
+        return (
+            len(self.body) >= GZIP_MIN_SIZE
+            and self.media_type.startswith(COMPRESSIBLE_TYPES)
+        )
+
+    @property
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body)
+        return self._gzipped
+
+
+def accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "")
+
+
+def etag_matches(request: Request, *etags: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag in etags:
+            return True
+    return False
+
+
+def page_response(
+    request: Request,
+    page: Page,
+    status_code: int = 200,
+    headers: Optional[dict] = None,
+) -> responses.Response:
+    """
+    Turns a page into a response, answering with a bodiless 304 when the
+    client already has it and gzipping it when the client accepts that.
+    """
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    use_gzip = page.compressible and accepts_gzip(request)
+    etag = page.gzip_etag if use_gzip else page.etag
+    headers["ETag"] = etag
+
+    if status_code == 200 and etag_matches(request, page.etag, page.gzip_etag):
+        return responses.Response(status_code=304, headers=headers)
+
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        body = page.gzipped
+    else:
+        body = page.body
+
+    return responses.Response(
+        content=body,
+        status_code=status_code,
+        media_type=page.media_type,
+        headers=headers,
+    )
+
+
+def json_response(request: Request, payload: Any, status_code: int = 200) -> responses.Response:
+    """ Like ORJSONResponse but with an ETag and gzip like `page_response` """
+    page = Page(orjson.dumps(payload), "application/json")
+    return page_response(request, page, status_code)
@@ -1,14 +1,32 @@
 import os
 
 from json import load, dump
+from typing import List, Optional
 from pydantic import BaseModel
 
 
+class LiveServerSettings(BaseModel):
+    id: str
+    rtmp_domain: str
+    control_domain: str
+    control_scheme: str = "https"
+
+    # None takes the region from the id, e.g. us-1 -> us
+    region: Optional[str] = None
+    capacity: int = 100
+
+    # Draining servers keep their rooms but don't get any new ones
+    draining: bool = False
+
+
 class ServerSettings(BaseModel):
     # Changeable
     serve_static: bool = False
     secure_sessions: bool = False
 
+    # Amount of pre-forked worker processes, 0 uses one per cpu core
+    workers: int = 1
+
     # Authorization and cookies
     secure_key: str
     bot_auth: str
@@ -25,6 +43,106 @@ class ServerSettings(BaseModel):
     spooderfy_domain: str = "spooderfy.com"
     gateway_domain: str = "gateway.spooderfy.com"
 
+    # Length of new room ids
+    room_id_length: int = 5
+
+    # Caching
+    room_cache_size: int = 1024
+    room_cache_ttl: Optional[float] = 30.0
+
+    # Shared cache between workers, None keeps everything in process which
+    # means room changes only reach other workers once room_cache_ttl passes
+    redis_url: Optional[str] = None
+
+    # Outgoing http connection pool
+    http_pool_size: int = 100
+    http_pool_per_host: int = 20
+    http_timeout: float = 10.0
+
+    # Discord api used for logins, at most discord_concurrency requests are
+    # made at once and a rate limited request is retried discord_max_retries
+    # times as long as discord asks to wait no more than discord_max_retry_wait
+    discord_api_url: str = "https://discord.com/api"
+    discord_concurrency: int = 10
+    discord_timeout: float = 10.0
+    discord_max_retries: int = 3
+    discord_max_retry_wait: float = 10.0
+
+    # How long room stats from the gateway are reused, every viewer of a
+    # room polling its stats in that time shares one gateway call
+    room_stats_ttl: float = 2.0
+    room_stats_error_ttl: float = 1.0
+
+    # Timeout of each upstream call made while creating or deleting a room
+    room_step_timeout: float = 5.0
+
+    # Most upstream calls a bulk room request makes to one live server at once
+    bulk_server_concurrency: int = 8
+
+    # Room events forwarded to the gateway, once a room has emit_queue_size
+    # events waiting new ones are refused with a 429 ("reject") or the
+    # oldest waiting event is thrown away ("drop"). Up to emit_batch_size
+    # waiting events are posted at once when the gateway has a batch route,
+    # 1 posts every event on its own.
+    gateway_emit_url: str = "http://spooderfy_gateway:3030/emit"
+    emit_queue_size: int = 256
+    emit_batch_size: int = 64
+    emit_overflow: str = "reject"
+
+    # Websockets, pings are sent both by the server at the protocol level
+    # and by each connection as a message for clients that can't see those
+    websocket_queue_size: int = 64
+    websocket_ping_interval: float = 20.0
+    websocket_ping_timeout: float = 20.0
+    websocket_idle_timeout: float = 60.0
+
+    # The live server fleet, reloaded while running when the file changes
+    live_servers: List[LiveServerSettings] = [
+        LiveServerSettings(
+            id="us-1",
+            rtmp_domain="us1.spooderfy.com",
+            control_domain="us-live-1.spooderfy.com",
+        ),
+        LiveServerSettings(
+            id="us-2",
+            rtmp_domain="us2.spooderfy.com",
+            control_domain="us-live-2.spooderfy.com",
+        ),
+    ]
+    default_live_server: str = "us-1"
+
+    # How often live servers are checked for their health and load
+    live_server_poll_interval: float = 10.0
+
+    # How often the settings file is checked for changes, 0 disables it
+    settings_watch_interval: float = 5.0
+
+    # Keep session data server side and only a session id in the cookie
+    server_sessions: bool = False
+    session_ttl: float = 7 * 24 * 60 * 60
+    room_access_ttl: float = 24 * 60 * 60
+
+    # Leaderboard entries per page and how often changes made through
+    # other workers are picked up in seconds
+    leaderboard_page_size: int = 50
+    leaderboard_sync_interval: float = 1.0
+
+    # How often pages of the live season are rebuilt in seconds and where
+    # the snapshots of finished seasons are kept
+    leaderboard_render_interval: float = 5.0
+    seasons_directory: str = "./seasons"
+
+    # Amount of rendered pages kept in memory
+    rendered_cache_size: int = 4096
+
+    # How often remote assets are revalidated in seconds
+    asset_refresh_interval: float = 300.0
+
+    # Every worker writes its metrics here every metrics_flush_interval
+    # seconds, /metrics sums them so a scrape covers every worker
+    metrics_directory: str = "./.cache/metrics"
+    metrics_flush_interval: float = 5.0
+
 
 def load_settings(path: str) -> ServerSettings:
     if not os.path.exists(path):
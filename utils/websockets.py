@@ -0,0 +1,129 @@
+import asyncio
+
+from typing import Any, AsyncIterator, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+from starlette.websockets import WebSocketState
+
+
+# Close codes, see RFC 6455 section 7.4.1
+GOING_AWAY = 1001
+UNSUPPORTED_DATA = 1003
+POLICY_VIOLATION = 1008
+TRY_AGAIN_LATER = 1013
+
+
+class Connection:
+    """
+    A long lived websocket with its own send queue.
+
+    Messages are sent by a writer task draining a bounded queue, so a client
+    that doesn't read fast enough only ever holds up its own connection:
+    `send` waits for room in the queue and `try_send` refuses the message
+    instead. A client that stays silent for `idle_timeout` seconds is
+    disconnected, pings every `ping_interval` seconds give well behaved
+    clients something to answer.
+
+        async with Connection(websocket) as conn:
+            async for message in conn:
+                ...
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_queue: int = 64,
+        ping_interval: Optional[float] = 20.0,
+        idle_timeout: Optional[float] = 60.0,
+    ):
+        self.websocket = websocket
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._ping_interval = ping_interval
+        self._idle_timeout = idle_timeout
+        self._tasks = []
+        self.closed = False
+
+    @property
+    def session(self):
+        return self.websocket.session
+
+    async def __aenter__(self) -> "Connection":
+        await self.websocket.accept()
+
+        loop = asyncio.get_event_loop()
+        self._tasks.append(loop.create_task(self._write_forever()))
+        if self._ping_interval:
+            self._tasks.append(loop.create_task(self._ping_forever()))
+        return self
+
+    async def __aexit__(self, *_exc):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self.close()
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self.closed:
+            return
+
+        self.closed = True
+        if self.websocket.application_state == WebSocketState.CONNECTED:
+            try:
+                await self.websocket.close(code, reason)
+            except RuntimeError:
+                # The client went away first.
+                pass
+
+    def try_send(self, message: Any) -> bool:
+        """ Queues a message unless the queue is full """
+        if self.closed:
+            return False
+
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def send(self, message: Any):
+        """ Queues a message, waiting for the client to catch up if need be """
+        if not self.closed:
+            await self._queue.put(message)
+
+    async def _write_forever(self):
+        try:
+            while True:
+                message = await self._queue.get()
+                await self.websocket.send_json(message)
+        except (WebSocketDisconnect, RuntimeError):
+            self.closed = True
+
+    async def _ping_forever(self):
+        while not self.closed:
+            await asyncio.sleep(self._ping_interval)
+            self.try_send({"op": "ping"})
+
+    async def receive(self) -> Any:
+        """ The next message, raises WebSocketDisconnect once the client is gone """
+        try:
+            return await asyncio.wait_for(self.websocket.receive_json(), self._idle_timeout)
+        except asyncio.TimeoutError:
+            await self.close(GOING_AWAY, "idle timeout")
+            raise WebSocketDisconnect(GOING_AWAY)
+        except ValueError:
+            await self.close(UNSUPPORTED_DATA, "messages must be json")
+            raise WebSocketDisconnect(UNSUPPORTED_DATA)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        while not self.closed:
+            try:
+                message = await self.receive()
+            except WebSocketDisconnect:
+                self.closed = True
+                return
+
+            # Answers to our pings only count as activity.
+            if isinstance(message, dict) and message.get("op") == "pong":
+                continue
+            yield message